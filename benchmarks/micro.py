@@ -0,0 +1,198 @@
+# Microbenchmarks of the hot paths: indexed matching, geofences, cp and hp, and discord messages
+#
+#   python benchmarks/micro.py --save baseline.json
+#   python benchmarks/micro.py --compare baseline.json --threshold 0.1
+#
+# Run it from the repository root, the game data is loaded from data/
+
+import configargparse
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notifier import utils
+from notifier.config import Config
+from notifier.cptable import CpTable
+from notifier.discord import Discord
+from notifier.geofence import GeofenceIndex, PreparedPolygon, make_polygon
+from notifier.handler import Handler
+from notifier.rules import PokemonRuleIndex
+from notifier.utils import get_game_data
+
+POLYGON_SIZES = (4, 100, 1000, 10000)
+GEOFENCE_COUNTS = (5, 30, 300)
+BATCH_POINTS = 1000
+
+
+def make_handler(geofence):
+    config = Config({
+        'config': {},
+        'includes': {'all': {'pokemons': [{'min_id': 0, 'max_id': 999}]}},
+        'notification_settings': {'Default': {'includes': ['all']}}
+    })
+    config.geofences = {'area': {'polygon': geofence}}
+    config.geofence_index = GeofenceIndex(config.geofences)
+    return Handler(config, None)
+
+
+def benchmarks():
+    """
+    Returns the benchmarks by name, each a function without arguments
+    """
+    rng = random.Random(1)
+    game_data = get_game_data()
+    geofence = make_polygon(rng, 100, 47.6, -122.3, 0.1)
+    handler = make_handler(geofence)
+
+    pokemon = {
+        'id': 149, 'name': 'Dragonite', 'lat': 47.6, 'lon': -122.3, 'level': 30, 'cp': 2500,
+        'attack': 15, 'defense': 14, 'stamina': 13, 'iv': 93.3, 'move_1': 'Dragon Breath', 'move_2': 'Outrage',
+        'form': 'A', 'time': '12:00:00', 'time_left': '29m 59s', 'sublocality': 'Downtown',
+        'gamepress': 'https://pokemongo.gamepress.gg/pokemon/149',
+        'google_maps': 'http://maps.google.com/maps?q=47.6,-122.3',
+        'static_google_maps': 'https://maps.googleapis.com/maps/api/staticmap?center=47.6,-122.3'
+    }
+    raid = {'egg': False, 'level': 5, 'name': 'Lugia', 'cp': 42753, 'lat': 47.6, 'lon': -122.3,
+            'move_1': 'Extrasensory', 'move_2': 'Hydro Pump'}
+
+    pokemon_rules = {
+        'name_only': {'name': 'Dragonite'},
+        'thresholds': {'min_id': 1, 'max_id': 151, 'min_iv': 90, 'min_level': 25, 'min_attack': 10},
+        'cp_at_level': {'min_cp': {'30': 2000, '35': 2200}, 'max_hp': {'30': 100}},
+        'moves': {'moves': [{'move_1': 'Steel Wing'}, {'move_1': 'Dragon Breath', 'move_2': 'Outrage'}]},
+        'geofence': {'min_iv': 90, 'geofence': 'area'},
+        'everything': {'name': 'Dragonite', 'min_iv': 90, 'min_cp': {'30': 2000}, 'moves': [{'move_1': 'Dragon Breath'}],
+                       'geofence': 'area'}
+    }
+    raid_rules = {
+        'levels': {'levels': [4, 5]},
+        'pokemon_rules': {'levels': [5], 'geofence': 'area',
+                          'pokemons': [{'name': 'Lugia', 'min_cp': 40000, 'moves': [{'move_2': 'Hydro Pump'}]}]}
+    }
+
+    result = {}
+    # the way handle_pokemon matches: the candidates from the compiled index, then every candidate rule
+    for shape, rules in pokemon_rules.items():
+        index = PokemonRuleIndex({shape: [rules]})
+        compiled = index.candidates(pokemon['id'])[0]
+        result['rule_matches.' + shape] = lambda index=index: \
+            [handler.rule_matches(pokemon, rule) for rule in index.candidates(pokemon['id'])]
+        result['matches_thresholds.' + shape] = lambda compiled=compiled: compiled.matches_thresholds(pokemon)
+
+    # a rule set the size of a busy city, most species have a few rules and some rules apply to all of them
+    many_rules = {'species%d' % pokemon_id: [{'min_id': pokemon_id, 'max_id': pokemon_id, 'min_iv': 90},
+                                             {'min_id': pokemon_id, 'max_id': pokemon_id, 'min_cp': {'30': 2000}}]
+                  for pokemon_id in range(1, 300)}
+    many_rules['wildcard'] = [{'min_iv': 100}, {'min_level': 30, 'min_attack': 15}, {'geofence': 'area'}]
+    index = PokemonRuleIndex(many_rules)
+    result['candidates'] = lambda: index.candidates(pokemon['id'])
+    result['rule_matches.city'] = lambda: [handler.rule_matches(pokemon, rule) for rule in index.candidates(pokemon['id'])]
+    for shape, rules in raid_rules.items():
+        result['raid_matches.' + shape] = lambda rules=rules: handler.raid_matches(raid, rules)
+
+    for size in POLYGON_SIZES:
+        polygon = make_polygon(rng, size, 47.6, -122.3, 0.1)
+        prepared = PreparedPolygon('polygon', polygon)
+        points = [(rng.uniform(47.45, 47.75), rng.uniform(-122.45, -122.15)) for _ in range(10)]
+        result['is_inside_polygon.%d' % size] = \
+            lambda polygon=polygon, points=points: [utils.is_inside_polygon(polygon, x, y) for x, y in points]
+        result['prepared_polygon.%d' % size] = \
+            lambda prepared=prepared, points=points: [prepared.contains(x, y) for x, y in points]
+
+    # the geofences of a batch of points, one lookup per point or all of them at once
+    points = [(rng.uniform(47.4, 47.8), rng.uniform(-122.5, -122.1)) for _ in range(BATCH_POINTS)]
+    for count in GEOFENCE_COUNTS:
+        radius = 0.2 / count ** 0.5
+        index = GeofenceIndex({'fence%d' % i: {'polygon': make_polygon(rng, 100, rng.uniform(47.4, 47.8),
+                                                                       rng.uniform(-122.5, -122.1), radius)}
+                               for i in range(count)})
+        result['geofences_at.%d' % count] = \
+            lambda index=index: dict((point, index.geofences_at(point[0], point[1])) for point in points)
+        result['geofences_at_many.%d' % count] = lambda index=index: index.geofences_at_many(points)
+
+    cp_table = CpTable(game_data)
+    result['get_cp_for_level'] = lambda: utils.get_cp_for_level(149, 30.0, 15, 14, 13)
+    result['get_hp_for_level'] = lambda: utils.get_hp_for_level(149, 30.0, 13)
+    result['cp_table.cp'] = lambda: cp_table.cp(149, 30.0, 15, 14, 13)
+    result['cp_table.hp'] = lambda: cp_table.hp(149, 30.0, 13)
+
+    result['discord.create_embedded'] = lambda: Discord.create_embedded(pokemon)
+    result['discord.create_title'] = lambda: Discord.create_title(pokemon)
+
+    return result
+
+
+def measure(function, repeat, min_time):
+    """
+    Returns the fastest time of a single call in microseconds
+    """
+    timer = timeit.Timer(function)
+
+    # find a number of calls that takes at least min_time, so timer resolution doesn't matter
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+
+    return min(timer.repeat(repeat, number)) / number * 1000000
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change of every benchmark against the baseline, returns the names of the regressions
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            print('%-36s %12.3fus  (new)' % (name, results[name]))
+            continue
+
+        change = results[name] / baseline[name] - 1
+        flag = ''
+        if change > threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = 'faster'
+        print('%-36s %12.3fus %12.3fus %+8.1f%%  %s' % (name, baseline[name], results[name], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = configargparse.ArgParser(description='Runs the microbenchmarks')
+    parser.add_argument('-k', '--filter', help='Only run benchmarks with this in their name')
+    parser.add_argument('--repeat', help='Repetitions, the fastest one counts', type=int, default=5)
+    parser.add_argument('--min-time', help='Minimum seconds per repetition', type=float, default=0.2)
+    parser.add_argument('--save', help='Save the results to this json file as a baseline')
+    parser.add_argument('--compare', help='Compare the results with this baseline json file')
+    parser.add_argument('--threshold', help='Relative slowdown that counts as a regression', type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = {}
+    for name, function in sorted(benchmarks().items()):
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(function, args.repeat, args.min_time)
+        if not args.compare:
+            print('%-36s %12.3fus' % (name, results[name]))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'benchmarks': results}, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['benchmarks']
+
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('%d regressions beyond %.0f%%: %s' % (len(regressions), args.threshold * 100, ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
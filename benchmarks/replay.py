@@ -0,0 +1,237 @@
+# Replays recorded or generated scanner frames through the notifier, without sending anything
+#
+#   python benchmarks/replay.py --frames 1000000
+#   python benchmarks/replay.py --recorded webhooks.json --config config/config.json
+#
+# Run it from the repository root, the game data is loaded from data/
+
+from array import array
+import configargparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notifier import NotificationHandler
+from notifier.ingest import iter_frames
+from notifier.manager import NotifierManager
+from notifier.utils import get_game_data
+
+
+class CountingHandler(NotificationHandler):
+    def __init__(self):
+        super(CountingHandler, self).__init__()
+        self.counts = {'pokemon': 0, 'gym': 0, 'raid': 0, 'egg': 0}
+
+    def notify_pokemon(self, endpoint, pokemon):
+        self.counts['pokemon'] += 1
+
+    def notify_gym(self, endpoint, gym):
+        self.counts['gym'] += 1
+
+    def notify_raid(self, endpoint, raid):
+        self.counts['raid'] += 1
+
+    def notify_egg(self, endpoint, egg):
+        self.counts['egg'] += 1
+
+
+def synthetic_config(rng, species):
+    rare = rng.sample(species, min(20, len(species)))
+    return {
+        'config': {},
+        'trainers': ['Trainer%d' % i for i in range(10)],
+        'includes': {
+            'perfect': {'pokemons': [{'min_iv': 100}]},
+            'rare': {'pokemons': [{'min_id': pokemon_id, 'max_id': pokemon_id} for pokemon_id in rare]},
+            'high_iv': {'pokemons': [{'min_iv': 90, 'min_level': 25}]},
+            'strong': {'pokemons': [{'min_id': pokemon_id, 'max_id': pokemon_id, 'min_cp': {'30': 2500}}
+                                    for pokemon_id in rare[:5]]},
+            'moves': {'pokemons': [{'name': 'Dragonite', 'moves': [{'move_1': 'Dragon Breath'}]}]},
+            'area': {'pokemons': [{'min_lat': 47.5, 'max_lat': 47.6, 'min_lon': -122.4, 'max_lon': -122.3,
+                                   'min_iv': 80}]}
+        },
+        'raid_includes': {
+            'legendary': {'levels': [4, 5]},
+            'eggs': {'levels': [5], 'raid': False}
+        },
+        'notification_settings': {
+            'everything': {
+                'includes': ['perfect', 'rare', 'high_iv', 'strong', 'moves', 'area'],
+                'raid_includes': ['legendary', 'eggs'],
+                'gym': True
+            }
+        }
+    }
+
+
+def parse_species(mix, species):
+    """
+    Returns the pokemon ids and their cumulative weights, from "id:weight,id:weight" or all species alike
+    """
+    if not mix:
+        pairs = [(pokemon_id, 1.0) for pokemon_id in species]
+    else:
+        pairs = [(int(pokemon_id), float(weight)) for pokemon_id, weight in
+                 (entry.split(':') for entry in mix.split(','))]
+
+    ids = []
+    cumulative = []
+    total = 0.0
+    for pokemon_id, weight in pairs:
+        total += weight
+        ids.append(pokemon_id)
+        cumulative.append(total)
+    return ids, cumulative
+
+
+def generate_frames(args, rng, species):
+    from bisect import bisect_left
+
+    ids, cumulative = parse_species(args.species, species)
+    now = int(time.time())
+    gyms = ['gym%d' % i for i in range(args.gyms)]
+
+    for i in range(args.frames):
+        kind = rng.random()
+        latitude = rng.uniform(47.4, 47.8)
+        longitude = rng.uniform(-122.5, -122.1)
+
+        if kind < args.raid_share:
+            level = rng.randint(1, 5)
+            egg = rng.random() < 0.5
+            yield {'type': 'raid', 'message': {
+                'gym_id': rng.choice(gyms), 'latitude': latitude, 'longitude': longitude,
+                'spawn': now, 'start': now + rng.randint(0, 3600), 'end': now + rng.randint(3600, 7200),
+                'level': level, 'pokemon_id': None if egg else rng.choice(ids),
+                'cp': None if egg else rng.randint(10000, 50000), 'move_1': 1, 'move_2': 2}}
+        elif kind < args.raid_share + args.gym_share:
+            yield {'type': 'gym_details', 'message': {
+                'id': rng.choice(gyms), 'name': 'Gym', 'latitude': latitude, 'longitude': longitude,
+                'team': rng.randint(0, 3),
+                'pokemon': [{'trainer_name': 'Trainer%d' % rng.randint(0, 50)} for _ in range(rng.randint(1, 6))]}}
+        else:
+            pokemon_id = ids[bisect_left(cumulative, rng.random() * cumulative[-1])]
+            message = {
+                'encounter_id': 'encounter%d' % i, 'pokemon_id': pokemon_id,
+                'latitude': latitude, 'longitude': longitude,
+                'disappear_time': now + rng.randint(60, 1800)
+            }
+            if rng.random() < args.iv_share:
+                message.update({
+                    'individual_attack': rng.randint(args.iv_floor, 15),
+                    'individual_defense': rng.randint(args.iv_floor, 15),
+                    'individual_stamina': rng.randint(args.iv_floor, 15),
+                    'pokemon_level': rng.randint(1, 35),
+                    'cp': rng.randint(10, 3000),
+                    'move_1': rng.randint(200, 280),
+                    'move_2': rng.randint(13, 140)
+                })
+            yield {'type': 'pokemon', 'message': message}
+
+
+def recorded_frames(filename):
+    # either one json array of frames, or one webhook request body per line
+    with open(filename) as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            for frame in iter_frames(f):
+                yield frame
+        else:
+            for line in f:
+                if line.strip():
+                    data = json.loads(line)
+                    for frame in (data if isinstance(data, list) else [data]):
+                        yield frame
+
+
+def percentile(values, percent):
+    return values[min(len(values) - 1, len(values) * percent // 100)] if values else 0.0
+
+
+def replay(manager, frames, batch_size):
+    # an array rather than a list of floats, so it hardly adds to the peak rss
+    latencies = array('d')
+    batch = []
+    started = time.time()
+
+    def run(batch):
+        manager.handler.prime_geofences(batch)
+        for data in batch:
+            start = time.time()
+            manager.dispatch(data)
+            latencies.append(time.time() - start)
+
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) >= batch_size:
+            run(batch)
+            batch = []
+    if batch:
+        run(batch)
+
+    return time.time() - started, latencies
+
+
+def main():
+    parser = configargparse.ArgParser(description='Replays scanner frames through the notifier and reports throughput')
+    parser.add_argument('-n', '--frames', help='Number of frames to generate', type=int, default=100000)
+    parser.add_argument('--recorded', help='Replay frames from this file instead of generating them')
+    parser.add_argument('-c', '--config', help='Config file with the rules, a synthetic rule set by default')
+    parser.add_argument('--species', help='Species mix as id:weight,id:weight, all species alike by default')
+    parser.add_argument('--iv-share', help='Share of pokemon with IVs', type=float, default=0.3)
+    parser.add_argument('--iv-floor', help='Lowest generated individual value', type=int, default=0)
+    parser.add_argument('--raid-share', help='Share of raid and egg frames', type=float, default=0.05)
+    parser.add_argument('--gym-share', help='Share of gym details frames', type=float, default=0.02)
+    parser.add_argument('--gyms', help='Number of distinct gyms', type=int, default=500)
+    parser.add_argument('--batch-size', help='Frames per batch', type=int, default=200)
+    parser.add_argument('--seed', help='Random seed', type=int, default=1)
+    parser.add_argument('--json', help='Print the results as json', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    rng = random.Random(args.seed)
+    # only species with known base stats, so cp and hp rules can be evaluated
+    game_data = get_game_data()
+    species = [pokemon_id for pokemon_id in range(1, len(game_data.pokemon_names))
+               if game_data.stats(pokemon_id) is not None]
+    config = args.config if args.config else synthetic_config(rng, species)
+
+    manager = NotifierManager(config)
+    handler = CountingHandler()
+    for name in manager.config.notification_handlers.keys():
+        manager.notifier.set_notification_handler(name, handler)
+
+    frames = recorded_frames(args.recorded) if args.recorded else generate_frames(args, rng, species)
+    elapsed, latencies = replay(manager, frames, args.batch_size)
+
+    # before sorting, the sorted copy of the latencies isn't part of the replay
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    latencies = sorted(latencies)
+    results = {
+        'messages': len(latencies),
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'p50_us': round(percentile(latencies, 50) * 1000000, 2),
+        'p99_us': round(percentile(latencies, 99) * 1000000, 2),
+        'peak_rss_kb': peak_rss,
+        'notifications': handler.counts
+    }
+
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+    else:
+        for key in sorted(results):
+            print('%-20s %s' % (key, results[key]))
+
+
+if __name__ == '__main__':
+    main()
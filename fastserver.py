@@ -0,0 +1,200 @@
+# Lightweight receiver, acknowledges webhook requests right away and parses them in a separate thread
+
+from collections import deque
+from gevent.server import StreamServer
+from threading import Lock, Thread
+import json
+import logging
+import Queue
+import socket
+import time
+
+from notifier.ingest import QueueFull
+from notifier.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+MAX_HEADER_SIZE = 65536
+MAX_BODY_SIZE = 16 * 1024 * 1024
+MAX_QUEUED_BODIES = 1000
+
+
+class LatencyRecorder:
+    """
+    Keeps the latencies of the most recent requests
+    """
+
+    def __init__(self, size=10000):
+        self.lock = Lock()
+        self.latencies = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.count += 1
+
+    def percentiles(self, percentiles=(50, 90, 99)):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            count = self.count
+
+        result = {'requests': count}
+        for percentile in percentiles:
+            if latencies:
+                index = min(len(latencies) - 1, len(latencies) * percentile // 100)
+                result['p%d_ms' % percentile] = round(latencies[index] * 1000, 3)
+            else:
+                result['p%d_ms' % percentile] = None
+        return result
+
+
+class FastReceiver:
+    """
+    HTTP/1.1 server answering every POST with 200 as soon as its body is read, with keep-alive and pipelining.
+    Bodies are handed to a parse thread, so the scanner never waits on parsing or matching.
+    Latency percentiles are served on GET /stats, besides the /metrics and /profile of runserver.py.
+
+    At most queue_size bodies wait for the parse thread, requests beyond that are answered with 503.
+    Because a request is acknowledged before it's parsed, a full ingest queue can't answer 503 here,
+    rejected frames are dropped and logged instead.
+    """
+
+    def __init__(self, receiver, host, port, stats_interval=300, max_body_size=MAX_BODY_SIZE,
+                 queue_size=MAX_QUEUED_BODIES):
+        self.receiver = receiver
+        self.stats_interval = stats_interval
+        self.max_body_size = max_body_size
+        self.bodies = Queue.Queue(queue_size)
+        self.latencies = LatencyRecorder()
+        self.server = StreamServer((host, port), self.handle)
+
+        self.parser = Thread(target=self.parse, name='Parser')
+        self.parser.daemon = True
+
+    def start(self):
+        self.parser.start()
+        self.server.start()
+
+    def serve_forever(self):
+        self.parser.start()
+        self.server.serve_forever()
+
+    def parse(self):
+        last_stats = time.time()
+        while True:
+            if time.time() - last_stats > self.stats_interval:
+                log.info('Webhook request latencies: %s', self.latencies.percentiles())
+                last_stats = time.time()
+
+            try:
+                body = self.bodies.get(timeout=1)
+            except Queue.Empty:
+                continue
+
+            try:
+                self.receiver.process(body)
+            except QueueFull:
+                # the rejected frame itself is counted by the manager
+                metrics.count('dropped_requests')
+                log.warning('Ingest queue is full, dropped frames of a webhook request')
+            except Exception:
+                log.exception('Error processing webhook request')
+
+    def handle(self, connection, address):
+        buffer = ''
+        try:
+            while True:
+                # with pipelining, the next request may be in the buffer already
+                start = time.time() if buffer else None
+
+                end = buffer.find('\r\n\r\n')
+                while end < 0:
+                    if len(buffer) > MAX_HEADER_SIZE:
+                        self.respond(connection, '431 Request Header Fields Too Large', keep_alive=False)
+                        return
+                    data = connection.recv(65536)
+                    if not data:
+                        return
+                    if start is None:
+                        start = time.time()
+                    buffer += data
+                    end = buffer.find('\r\n\r\n')
+
+                lines = buffer[:end].split('\r\n')
+                buffer = buffer[end + 4:]
+                try:
+                    method, path, version = lines[0].split(' ', 2)
+                    headers = dict((name.strip().lower(), value.strip())
+                                   for name, value in (line.split(':', 1) for line in lines[1:]))
+                    length = int(headers.get('content-length', 0))
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    self.respond(connection, '400 Bad Request', keep_alive=False)
+                    return
+
+                if 'transfer-encoding' in headers:
+                    self.respond(connection, '411 Length Required', keep_alive=False)
+                    return
+
+                if length > self.max_body_size:
+                    self.respond(connection, '413 Payload Too Large', keep_alive=False)
+                    return
+
+                # the chunks are joined once, appending to a string would copy the body over and over
+                chunks = [buffer]
+                received = len(buffer)
+                while received < length:
+                    data = connection.recv(min(65536, length - received))
+                    if not data:
+                        return
+                    chunks.append(data)
+                    received += len(data)
+                buffer = ''.join(chunks)
+                body = buffer[:length]
+                buffer = buffer[length:]
+
+                connection_header = headers.get('connection', '').lower()
+                if version == 'HTTP/1.0':
+                    keep_alive = connection_header == 'keep-alive'
+                else:
+                    keep_alive = connection_header != 'close'
+
+                if method == 'POST':
+                    if body:
+                        try:
+                            self.bodies.put_nowait(body)
+                        except Queue.Full:
+                            # the parse thread is falling behind, the scanner should back off and retry
+                            metrics.count('rejected_requests')
+                            self.respond(connection, '503 Service Unavailable', keep_alive=keep_alive)
+                            if not keep_alive:
+                                return
+                            continue
+                    self.respond(connection, '200 OK', keep_alive=keep_alive)
+                    self.latencies.add(time.time() - start)
+                elif method == 'GET' and path == '/stats':
+                    self.respond(connection, '200 OK', json.dumps(self.latencies.percentiles()), keep_alive)
+                elif method == 'GET' and path == '/metrics':
+                    self.respond(connection, '200 OK', json.dumps(metrics.snapshot()), keep_alive, 'application/json')
+                elif method == 'GET' and path == '/profile':
+                    report = self.receiver.profile_report()
+                    if report is None:
+                        self.respond(connection, '404 Not Found', 'Rule profiling is not enabled\n', keep_alive)
+                    else:
+                        self.respond(connection, '200 OK', report + '\n', keep_alive)
+                else:
+                    self.respond(connection, '404 Not Found', keep_alive=keep_alive)
+
+                if not keep_alive:
+                    return
+        except socket.error:
+            pass
+        finally:
+            connection.close()
+
+    @staticmethod
+    def respond(connection, status, body='', keep_alive=True, content_type='text/plain'):
+        connection.sendall('HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n%s' %
+                           (status, content_type, len(body), 'keep-alive' if keep_alive else 'close', body))
@@ -0,0 +1,206 @@
+from multiprocessing import Event, Process, Queue
+from threading import Thread
+from .config import Config
+from .ingest import MESSAGE_TYPES, ExpiryFilter, QueueFull
+from .metrics import metrics
+from .manager import NotifierManager
+from .notificationhandler import NotificationHandler
+from .reload import RESTART_SETTINGS, ConfigReloader, format_changes, restart_settings
+import copy
+import logging
+import Queue as queue
+import signal
+import sys
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+
+class ForwardingHandler(NotificationHandler):
+    """
+    Renders notifications in a worker process with the real handler, and sends the payloads
+    to the delivery thread of the main process
+    """
+
+    def __init__(self, name, handler, outbound):
+        super(ForwardingHandler, self).__init__()
+        self.name = name
+        self.handler = handler
+        self.outbound = outbound
+
+    def render(self, kind, data):
+        return self.handler.render(kind, data)
+
+    def deliver(self, endpoint, kind, payload):
+        self.outbound.put((self.name, endpoint, kind, payload))
+
+
+def forward_reloads(reload_event, reloader):
+    while True:
+        reload_event.wait()
+        reload_event.clear()
+        reloader.request()
+
+
+def run_worker(config_file, shard, inbound, outbound, reload_event):
+    # the main process watches the config, and sets reload_event when the workers should reload.
+    # it's kept apart from the frames, so webhook requests can't trigger a reload
+    manager = NotifierManager(config_file, inbound, watch=False)
+    manager.name = 'Shard-%d' % shard
+    for name, handler in manager.config.notification_handlers.items():
+        manager.notifier.set_notification_handler(name, ForwardingHandler(name, handler, outbound))
+
+    reloads = Thread(target=forward_reloads, args=(reload_event, manager.reloader), name='Reloads')
+    reloads.daemon = True
+    reloads.start()
+
+    # workers are stopped with SIGTERM, and exit without running atexit handlers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        manager.run()
+    finally:
+        manager.stop()
+
+
+class ShardedNotifierManager:
+    """
+    Runs matching in several worker processes. Pokemon are sharded by encounter id and raids and gyms
+    by gym id, so each worker only needs the dedup and gym state of its own shard.
+    All notifications are delivered from a single thread in this process.
+    """
+
+    def __init__(self, config_file, processes):
+        # Config resolves a config dict in place, the workers need it untouched
+        self.config = Config(copy.deepcopy(config_file))
+        if self.config.metrics:
+            metrics.enabled = True
+
+        self.outbound = Queue()
+        # a queue_size of 0 means unbounded, the same as a multiprocessing queue of size 0
+        shard_queue_size = max(1, self.config.queue_size // processes) if self.config.queue_size else 0
+        self.inbound = [Queue(shard_queue_size) for _ in range(processes)]
+        self.shed = {'incoming': 0, 'rejected': 0}
+        self.expiry_filter = ExpiryFilter(self.config.min_pokemon_time_left, self.config.min_raid_time_left)
+        self.reload_events = [Event() for _ in range(processes)]
+        self.workers = []
+        for shard in range(processes):
+            worker = Process(target=run_worker, name='Shard-%d' % shard,
+                             args=(config_file, shard, self.inbound[shard], self.outbound, self.reload_events[shard]))
+            worker.daemon = True
+            self.workers.append(worker)
+
+        self.delivery = Thread(target=self.deliver, name='Delivery')
+        self.delivery.daemon = True
+
+        self.reloader = ConfigReloader(copy.deepcopy(config_file), self.config, self.config_reloaded,
+                                       self.config.reload_interval)
+        metrics.register('ingest', self.ingest_stats)
+
+    def ingest_stats(self):
+        # frames dropped or rejected because their shard queue was full, and dropped because they expire too soon
+        return {'expired': self.expiry_filter.stats(), 'queue': dict(self.shed)}
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        self.delivery.start()
+        self.reloader.start()
+        log.info('Started %d notifier processes', len(self.workers))
+
+    def config_reloaded(self, config, seconds):
+        # the delivery thread keeps the current handlers, with their sessions and pending deliveries
+        config.notification_handlers.update(self.config.notification_handlers)
+        config.build_dispatch_tables()
+        self.expiry_filter.min_pokemon_time_left = config.min_pokemon_time_left
+        self.expiry_filter.min_raid_time_left = config.min_raid_time_left
+        metrics.enabled = config.metrics
+
+        log.info('Reloaded the config in %.3fs: %s', seconds, format_changes(self.config, config))
+        # the shard queues are created with the worker processes
+        restart = restart_settings(self.config, config, RESTART_SETTINGS + ('queue_size',))
+        if restart:
+            log.warning('Changes of %s only take effect after a restart', ', '.join(restart))
+        self.config = config
+
+        # every worker builds the new config itself and swaps it in between batches
+        for reload_event in self.reload_events:
+            reload_event.set()
+
+    def log_profile(self, *args):
+        # the rules are matched, and profiled, by the workers
+        log.info('Rule profiling is not available when matching runs in separate processes')
+
+    def stop(self):
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    def deliver(self):
+        last_stats = time.time()
+        while True:
+            if time.time() - last_stats > self.config.stats_interval:
+                log.info('Ingest: %s', self.ingest_stats())
+                if metrics.enabled:
+                    metrics.log_summary()
+                last_stats = time.time()
+
+            try:
+                name, endpoint, kind, payload = self.outbound.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            try:
+                self.config.notification_handlers[name].deliver(endpoint, kind, payload)
+            except Exception:
+                log.exception('Error delivering %s to %s', kind, name)
+
+    @staticmethod
+    def shard_key(data):
+        message = data.get('message', {})
+        message_type = data.get('type')
+        if message_type == 'pokemon':
+            return message.get('encounter_id')
+        if message_type == 'raid':
+            return message.get('gym_id')
+        if message_type == 'gym_details':
+            return message.get('id')
+        return None
+
+    def shard(self, data):
+        key = self.shard_key(data)
+        if key is None:
+            return 0
+
+        # crc32 rather than hash(), so the shard of a key never depends on the process
+        return (zlib.crc32(str(key)) & 0xffffffff) % len(self.inbound)
+
+    def enqueue(self, data):
+        if data.get('type') not in MESSAGE_TYPES:
+            log.debug('Unsupported message type: %s', data.get('type'))
+            return
+
+        timed = metrics.enabled
+        if timed:
+            start = time.time()
+            # the workers measure queue wait from here, they run on the same clock
+            data['received'] = start
+
+        accepted = self.expiry_filter.accept(data)
+        if accepted:
+            self.put(data)
+
+        if timed:
+            metrics.count('frames' if accepted else 'expired', data.get('type'))
+            metrics.observe('ingest', data.get('type'), time.time() - start)
+
+    def put(self, data):
+        # the shard queues can't shed queued frames, so when full the new frame is dropped or rejected
+        try:
+            self.inbound[self.shard(data)].put_nowait(data)
+        except queue.Full:
+            if self.config.queue_policy == 'reject':
+                self.shed['rejected'] += 1
+                metrics.count('rejected', data.get('type'))
+                raise QueueFull()
+            self.shed['incoming'] += 1
@@ -1,3 +1,5 @@
+from .geofence import GeofenceIndex
+from .rules import PokemonRuleIndex
 import logging
 import commentjson as json
 import re
@@ -11,15 +13,45 @@ class Config:
         self.notification_handlers = {}
         self.pokemon_includes_to_notifications = {}
         self.raid_includes_to_notifications = {}
+        self.pokemon_includes_to_endpoints = {}
+        self.raid_includes_to_endpoints = {}
+        self.gym_endpoints = []
+        self.pokemon_dispatch = {}
+        self.raid_dispatch = {}
+        self.gym_dispatch = ()
         self.google_key = None
         self.fetch_sublocality = False
+        self.sublocality_precision = 3
+        self.sublocality_cache_size = 10000
+        self.sublocality_cache_file = None
         self.shorten_urls = False
+        self.cp_table = None
+        self.batch_size = 200
+        self.queue_size = 10000
+        self.queue_policy = 'drop_oldest'
+        self.body_queue_size = 1000
+        self.min_pokemon_time_left = 0
+        self.min_raid_time_left = 0
+        self.delivery_workers = 4
+        self.coalesce_notifications = False
+        self.stats_interval = 300
+        self.metrics = False
+        self.profile_rules = False
+        self.dedup_capacity = 250000
+        self.processes = 0
+        self.reload_interval = 10
+        self.geofence_file = None
+        self.sublocality_file = None
         self.endpoints = {}
         self.trainers = []
         self.notification_settings = {}
         self.pokemon_includes = {}
         self.raid_includes = {}
         self.geofences = {}
+        self.geofence_index = None
+        self.sublocality_index = None
+        self.pokemon_index = None
+        self.uses_geofences = False
 
         if isinstance(config_file, str):
             with open(config_file) as f:
@@ -34,11 +66,35 @@ class Config:
         config = parsed.get('config', {})
         self.google_key = config.get('google_key', self.google_key)
         self.fetch_sublocality = config.get('fetch_sublocality', self.fetch_sublocality)
+        self.sublocality_precision = config.get('sublocality_precision', self.sublocality_precision)
+        self.sublocality_cache_size = config.get('sublocality_cache_size', self.sublocality_cache_size)
+        self.sublocality_cache_file = config.get('sublocality_cache_file', self.sublocality_cache_file)
         self.shorten_urls = config.get('shorten_urls', self.shorten_urls)
-        geofence_file = config.get('geofence_file')
-
-        if geofence_file is not None:
-            self.load_geofences(geofence_file)
+        self.cp_table = config.get('cp_table', self.cp_table)
+        self.batch_size = config.get('batch_size', self.batch_size)
+        self.queue_size = config.get('queue_size', self.queue_size)
+        self.queue_policy = config.get('queue_policy', self.queue_policy)
+        self.body_queue_size = config.get('body_queue_size', self.body_queue_size)
+        self.min_pokemon_time_left = config.get('min_pokemon_time_left', self.min_pokemon_time_left)
+        self.min_raid_time_left = config.get('min_raid_time_left', self.min_raid_time_left)
+        self.delivery_workers = config.get('delivery_workers', self.delivery_workers)
+        self.coalesce_notifications = config.get('coalesce_notifications', self.coalesce_notifications)
+        self.stats_interval = config.get('stats_interval', self.stats_interval)
+        self.metrics = config.get('metrics', self.metrics)
+        self.profile_rules = config.get('profile_rules', self.profile_rules)
+        self.dedup_capacity = config.get('dedup_capacity', self.dedup_capacity)
+        self.processes = config.get('processes', self.processes)
+        self.reload_interval = config.get('reload_interval', self.reload_interval)
+        self.geofence_file = config.get('geofence_file', self.geofence_file)
+
+        if self.geofence_file is not None:
+            self.load_geofences(self.geofence_file)
+
+        self.geofence_index = GeofenceIndex(self.geofences)
+
+        self.sublocality_file = config.get('sublocality_file', self.sublocality_file)
+        if self.sublocality_file is not None:
+            self.sublocality_index = GeofenceIndex(self.parse_geofence_file(self.sublocality_file))
 
         self.endpoints = parsed.get('endpoints', self.endpoints)
         self.trainers = parsed.get('trainers', self.trainers)
@@ -51,7 +107,7 @@ class Config:
             if endpoint_type == 'discord' and 'discord' not in self.notification_handlers:
                 log.info('Adding Discord to available notification handlers')
                 from .discord import Discord
-                self.notification_handlers['discord'] = Discord()
+                self.notification_handlers['discord'] = Discord(self.delivery_workers, self.coalesce_notifications)
 
         self.pokemon_includes = parsed.get('includes', {})
         self.raid_includes = parsed.get('raid_includes', {})
@@ -95,6 +151,11 @@ class Config:
         if not self.pokemon_includes and not self.raid_includes:
             raise RuntimeError('No includes configured')
 
+        self.compile_pokemon_includes()
+        self.uses_geofences = self.rules_use_geofences()
+        self.resolve_endpoints()
+        self.build_dispatch_tables()
+
         # remove includes refs, because they are not needed. simplifies debugging
         for notification_setting in self.notification_settings:
             # these references are covered by another dict, namely self.includes_to_notifications
@@ -117,6 +178,74 @@ class Config:
         for include in self.pokemon_includes:
             self.pokemon_includes[include] = self.pokemon_includes[include]['pokemons']
 
+    def compile_pokemon_includes(self):
+        self.pokemon_index = PokemonRuleIndex(self.pokemon_includes)
+
+    def rules_use_geofences(self):
+        """
+        Returns True if any active pokemon or raid rule is restricted to a geofence
+        """
+        for rules in self.pokemon_includes.values():
+            if any('geofence' in pokemon for pokemon in rules):
+                return True
+
+        for include in self.raid_includes.values():
+            if 'geofence' in include or any('geofence' in pokemon for pokemon in include.get('pokemons', [])):
+                return True
+
+        return False
+
+    def resolve_endpoints(self):
+        """
+        Maps every include to the endpoints of all notification settings using it, so an endpoint
+        listed by several matching settings is notified only once
+        """
+        def unique_endpoints(notification_setting_refs):
+            endpoints = []
+            for notification_setting_ref in notification_setting_refs:
+                for endpoint_ref in self.notification_settings[notification_setting_ref].get('endpoints', ['simple']):
+                    if endpoint_ref not in endpoints:
+                        endpoints.append(endpoint_ref)
+            return endpoints
+
+        self.pokemon_includes_to_endpoints = {include: unique_endpoints(refs) for include, refs in
+                                              self.pokemon_includes_to_notifications.items()}
+        self.raid_includes_to_endpoints = {include: unique_endpoints(refs) for include, refs in
+                                           self.raid_includes_to_notifications.items()}
+        self.gym_endpoints = unique_endpoints(sorted(ref for ref, notification_setting in
+                                                     self.notification_settings.items()
+                                                     if notification_setting.get('gym')))
+
+    def build_dispatch_tables(self):
+        """
+        Resolves the endpoints of every include to (handler, endpoint ref, endpoint) tuples, so notifying
+        a match needs no further lookups. Raises RuntimeError for unknown endpoints or endpoint types,
+        so they fail when loading instead of in the notifier thread.
+        Called again whenever a notification handler is replaced.
+        """
+        def resolve(endpoint_refs):
+            entries = []
+            for endpoint_ref in endpoint_refs:
+                if endpoint_ref in self.endpoints:
+                    endpoint = self.endpoints[endpoint_ref]
+                elif endpoint_ref == 'simple':
+                    # the default of notification settings without endpoints
+                    endpoint = {}
+                else:
+                    raise RuntimeError('Unknown endpoint: %s' % endpoint_ref)
+
+                notification_type = endpoint.get('type', 'simple')
+                handler = self.notification_handlers.get(notification_type)
+                if handler is None:
+                    raise RuntimeError('Unsupported type %s of endpoint %s' % (notification_type, endpoint_ref))
+
+                entries.append((handler, endpoint_ref, endpoint))
+            return tuple(entries)
+
+        self.pokemon_dispatch = {include: resolve(refs) for include, refs in self.pokemon_includes_to_endpoints.items()}
+        self.raid_dispatch = {include: resolve(refs) for include, refs in self.raid_includes_to_endpoints.items()}
+        self.gym_dispatch = resolve(self.gym_endpoints)
+
     def parse_raid_includes(self):
         self.resolve_raid_configurations()
         #self.resolve_pokemon_refs()
@@ -191,6 +320,14 @@ class Config:
             target[key] = source[key]
 
     def load_geofences(self, filename):
+        self.geofences.update(self.parse_geofence_file(filename))
+
+    @staticmethod
+    def parse_geofence_file(filename):
+        """
+        Parses a file of [name] headers, each followed by the latitude,longitude lines of its polygon
+        """
+        geofences = {}
         with open(filename) as f:
             log.info('Loading %s', filename)
 
@@ -209,7 +346,7 @@ class Config:
                     name = name_match.groups()[0]
                     if name is None:
                         raise RuntimeError("wut")
-                    self.geofences[name] = {'boundaries': {}, 'polygon': []}
+                    geofences[name] = {'boundaries': {}, 'polygon': []}
                     continue
 
                 coords_match = re.match(coords_regex, line)
@@ -220,14 +357,14 @@ class Config:
                     coords = coords_match.groups()
                     x = float(coords[0])
                     y = float(coords[1])
-                    self.geofences[name]['polygon'].append((x, y))
+                    geofences[name]['polygon'].append((x, y))
 
-                    if not self.geofences[name]['boundaries']:
-                        self.geofences[name]['boundaries']['min'] = [x, y]
-                        self.geofences[name]['boundaries']['max'] = [x, y]
+                    if not geofences[name]['boundaries']:
+                        geofences[name]['boundaries']['min'] = [x, y]
+                        geofences[name]['boundaries']['max'] = [x, y]
                     else:
-                        min_xy = self.geofences[name]['boundaries']['min']
-                        max_xy = self.geofences[name]['boundaries']['max']
+                        min_xy = geofences[name]['boundaries']['min']
+                        max_xy = geofences[name]['boundaries']['max']
 
                         if x < min_xy[0]:
                             min_xy[0] = x
@@ -237,3 +374,5 @@ class Config:
                             min_xy[1] = y
                         if y > max_xy[1]:
                             max_xy[1] = y
+
+        return geofences
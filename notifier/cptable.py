@@ -0,0 +1,114 @@
+from array import array
+import logging
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+
+class CpTable:
+    """
+    Precomputed cp and hp values for every iv combination, built per species and level on first use
+    """
+
+    def __init__(self, game_data, use_numpy=None):
+        self.game_data = game_data
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy
+        self.cp_tables = {}
+        self.hp_tables = {}
+        # kept up to date as tables are built, so reporting it stays cheap
+        self.bytes = 0
+
+        if self.use_numpy and numpy is None:
+            raise RuntimeError('NumPy is not installed')
+
+    def cp(self, pokemon_id, level, iv_attack, iv_defense, iv_stamina):
+        key = (int(pokemon_id), self.game_data.level_index(level))
+        table = self.cp_tables.get(key)
+        if table is None:
+            table = self.build_cp(key[0], level)
+            self.cp_tables[key] = table
+            self.bytes += self.table_size(table)
+
+        return int(table[(iv_attack << 8) | (iv_defense << 4) | iv_stamina])
+
+    def hp(self, pokemon_id, level, iv_stamina):
+        key = (int(pokemon_id), self.game_data.level_index(level))
+        table = self.hp_tables.get(key)
+        if table is None:
+            table = self.build_hp(key[0], level)
+            self.hp_tables[key] = table
+            self.bytes += self.table_size(table)
+
+        return int(table[iv_stamina])
+
+    def get_base(self, pokemon_id, level):
+        stats = self.game_data.stats(pokemon_id)
+        if stats is None:
+            raise KeyError('No stats for pokemon %s' % pokemon_id)
+
+        cp_multiplier = self.game_data.cpm_for_level(level)
+        if cp_multiplier is None:
+            raise KeyError('No cp multiplier for level %s' % level)
+
+        return stats, cp_multiplier
+
+    def build_cp(self, pokemon_id, level):
+        stats, cp_multiplier = self.get_base(pokemon_id, level)
+        factor = math.pow(cp_multiplier, 2) / float(10)
+        ivs = range(16)
+
+        # same order of operations as utils.get_cp_for_level, so the results are identical
+        if self.use_numpy:
+            attack = numpy.arange(16, dtype=numpy.float64) + stats['attack']
+            sqrt_defense = numpy.sqrt(numpy.arange(16, dtype=numpy.float64) + stats['defense'])
+            sqrt_stamina = numpy.sqrt(numpy.arange(16, dtype=numpy.float64) + stats['stamina'])
+            cp = attack[:, None, None] * sqrt_defense[None, :, None] * sqrt_stamina[None, None, :] * factor
+            return numpy.floor(cp).astype(numpy.uint16).ravel()
+
+        sqrt_defense = [math.sqrt(stats['defense'] + iv) for iv in ivs]
+        sqrt_stamina = [math.sqrt(stats['stamina'] + iv) for iv in ivs]
+        table = array('H')
+        for iv_attack in ivs:
+            attack = stats['attack'] + iv_attack
+            for iv_defense in ivs:
+                partial = attack * sqrt_defense[iv_defense]
+                table.extend(int(math.floor(partial * s * factor)) for s in sqrt_stamina)
+        return table
+
+    def build_hp(self, pokemon_id, level):
+        stats, cp_multiplier = self.get_base(pokemon_id, level)
+        return array('H', [int(math.floor((stats['stamina'] + iv) * cp_multiplier)) for iv in range(16)])
+
+    def preload(self, pokemon_ids, levels):
+        """
+        Builds the cp and hp tables for the given species and levels up front
+        """
+        for pokemon_id in pokemon_ids:
+            if self.game_data.stats(pokemon_id) is None:
+                continue
+
+            for level in levels:
+                self.cp(pokemon_id, level, 0, 0, 0)
+                self.hp(pokemon_id, level, 0)
+
+        log.info('Precomputed %d cp tables using %d kB', len(self.cp_tables), self.memory_usage() / 1024)
+
+    def memory_usage(self):
+        """
+        Returns the number of bytes used by the table contents
+        """
+        return self.bytes
+
+    @staticmethod
+    def table_size(table):
+        if isinstance(table, array):
+            return table.itemsize * len(table)
+        return table.nbytes
+
+    def stats(self):
+        return {'cp_tables': len(self.cp_tables), 'hp_tables': len(self.hp_tables), 'bytes': self.bytes}
@@ -0,0 +1,205 @@
+from array import array
+import heapq
+
+
+class ExpiringSet:
+    """
+    Set of keys that expire at a given time. A min-heap ordered by expiry lets expire() remove
+    entries incrementally, in O(log n) each, without scanning the whole set.
+    """
+
+    def __init__(self):
+        self.expiries = {}
+        self.heap = []
+        self.peak = 0
+
+    def __contains__(self, key):
+        return key in self.expiries
+
+    def __len__(self):
+        return len(self.expiries)
+
+    def add(self, key, expiry):
+        self.expiries[key] = expiry
+        heapq.heappush(self.heap, (expiry, key))
+        self.peak = max(self.peak, len(self.expiries))
+
+    def expire(self, now):
+        """
+        Removes all keys expiring at or before now, returns how many were removed
+        """
+        removed = 0
+        while self.heap and self.heap[0][0] <= now:
+            expiry, key = heapq.heappop(self.heap)
+
+            # the key may have been added again with a later expiry
+            if self.expiries.get(key) == expiry:
+                del self.expiries[key]
+                removed += 1
+
+        return removed
+
+    def stats(self):
+        return {'size': len(self.expiries), 'peak': self.peak}
+
+
+class CompactDedupTable:
+    """
+    Fixed size set of keys with expiry times, for millions of encounter ids per day.
+    Keys are stored as 64 bit hashes in an open addressing table with linear probing, expiry times as
+    32 bit epoch seconds. When capacity keys are live, the oldest inserted one is evicted, so memory use never grows.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+        slots = 1
+        while slots < 2 * capacity:
+            slots *= 2
+        self.mask = slots - 1
+        self.hashes = array('l', [0]) * slots
+        self.expiries = array('I', [0]) * slots
+        self.count = 0
+
+        # insertion order, for evicting the oldest keys. entries of expired or re-added keys stay behind
+        # until the ring is compacted, twice the capacity keeps compacting rare
+        self.ring_size = 2 * capacity
+        self.ring_hashes = array('l', [0]) * self.ring_size
+        self.ring_expiries = array('I', [0]) * self.ring_size
+        self.ring_start = 0
+        self.ring_length = 0
+
+        self.sweep_position = 0
+        self.evicted = 0
+
+    @staticmethod
+    def hash_key(key):
+        # 0 marks an empty slot, hash() never returns -1 because CPython uses it to flag errors
+        return hash(key) or -1
+
+    def find(self, key_hash):
+        i = key_hash & self.mask
+        while self.hashes[i] != 0:
+            if self.hashes[i] == key_hash:
+                return i
+            i = (i + 1) & self.mask
+        return -1
+
+    def __contains__(self, key):
+        return self.find(self.hash_key(key)) >= 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key, expiry):
+        key_hash = self.hash_key(key)
+        expiry = int(expiry)
+
+        i = self.find(key_hash)
+        if i >= 0:
+            if self.expiries[i] == expiry:
+                return
+            self.expiries[i] = expiry
+        else:
+            if self.count >= self.capacity:
+                self.evict_oldest()
+
+            i = key_hash & self.mask
+            while self.hashes[i] != 0:
+                i = (i + 1) & self.mask
+            self.hashes[i] = key_hash
+            self.expiries[i] = expiry
+            self.count += 1
+
+        if self.ring_length == self.ring_size:
+            self.compact_ring()
+        end = (self.ring_start + self.ring_length) % self.ring_size
+        self.ring_hashes[end] = key_hash
+        self.ring_expiries[end] = expiry
+        self.ring_length += 1
+
+    def is_live(self, key_hash, expiry):
+        # the key may have expired already, or been added again later
+        i = self.find(key_hash)
+        return i >= 0 and self.expiries[i] == expiry
+
+    def evict_oldest(self):
+        while self.ring_length:
+            key_hash = self.ring_hashes[self.ring_start]
+            expiry = self.ring_expiries[self.ring_start]
+            self.ring_start = (self.ring_start + 1) % self.ring_size
+            self.ring_length -= 1
+
+            if self.is_live(key_hash, expiry):
+                self.delete(self.find(key_hash))
+                self.evicted += 1
+                return
+
+    def compact_ring(self):
+        # at most capacity entries are live, so this frees at least half of the ring
+        hashes = array('l', [0]) * self.ring_size
+        expiries = array('I', [0]) * self.ring_size
+        length = 0
+        for n in range(self.ring_length):
+            position = (self.ring_start + n) % self.ring_size
+            key_hash = self.ring_hashes[position]
+            expiry = self.ring_expiries[position]
+            if self.is_live(key_hash, expiry):
+                hashes[length] = key_hash
+                expiries[length] = expiry
+                length += 1
+
+        self.ring_hashes = hashes
+        self.ring_expiries = expiries
+        self.ring_start = 0
+        self.ring_length = length
+
+    def delete(self, i):
+        # shift following entries of the probe sequence back, so lookups never hit a gap
+        mask = self.mask
+        j = i
+        while True:
+            j = (j + 1) & mask
+            if self.hashes[j] == 0:
+                break
+
+            home = self.hashes[j] & mask
+            if (i <= j and (home <= i or home > j)) or (i > j and home <= i and home > j):
+                self.hashes[i] = self.hashes[j]
+                self.expiries[i] = self.expiries[j]
+                i = j
+
+        self.hashes[i] = 0
+        self.expiries[i] = 0
+        self.count -= 1
+
+    def expire(self, now, slots=None):
+        """
+        Removes expired keys from the next part of the table, so a full sweep is spread over many calls.
+        Returns how many were removed.
+        """
+        size = self.mask + 1
+        if slots is None:
+            slots = max(1024, size // 256)
+
+        removed = 0
+        position = self.sweep_position
+        end = min(position + slots, size)
+        while position < end:
+            if self.hashes[position] != 0 and self.expiries[position] <= now:
+                # deleting may shift another entry into this slot, so check it again
+                self.delete(position)
+                removed += 1
+            else:
+                position += 1
+
+        self.sweep_position = position if position < size else 0
+        return removed
+
+    def memory_usage(self):
+        return (self.hashes.itemsize + self.expiries.itemsize) * len(self.hashes) + \
+            (self.ring_hashes.itemsize + self.ring_expiries.itemsize) * self.ring_size
+
+    def stats(self):
+        return {'size': self.count, 'capacity': self.capacity, 'evicted': self.evicted,
+                'bytes': self.memory_usage()}
@@ -0,0 +1,272 @@
+from .metrics import metrics
+from threading import Condition, Lock, Thread
+import heapq
+import itertools
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """
+    Raised by a send function when the endpoint asked us to wait before sending again
+    """
+
+    def __init__(self, retry_after):
+        super(RateLimited, self).__init__('Rate limited for %.2fs' % retry_after)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Rate limit of a single endpoint, learned from the responses it sends back
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+        self.window = None
+        self.blocked_until = 0.0
+
+    def update(self, limit=None, remaining=None, reset_after=None, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            if limit is not None:
+                self.limit = limit
+            if remaining is not None:
+                self.remaining = remaining
+            if reset_after is not None:
+                self.reset_at = now + reset_after
+                # reset_after is what's left of the current window, so the largest one seen is closest to its length
+                if self.window is None or reset_after > self.window:
+                    self.window = reset_after
+
+    def block(self, seconds, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def reserve(self, now=None):
+        """
+        Takes a token and returns 0, or returns the number of seconds to wait before trying again
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            if now < self.blocked_until:
+                return self.blocked_until - now
+
+            if self.remaining is None:
+                return 0
+
+            if now >= self.reset_at:
+                if self.limit is None or not self.window:
+                    return 0
+
+                # new window, assume a full bucket until the endpoint tells us otherwise
+                self.remaining = self.limit
+                self.reset_at = now + self.window
+
+            if self.remaining <= 0:
+                return self.reset_at - now
+
+            self.remaining -= 1
+            return 0
+
+
+class Delivery:
+    def __init__(self, key, data):
+        self.key = key
+        self.data = data
+        self.attempts = 0
+
+
+class DeliveryPool:
+    """
+    Worker threads sending queued deliveries, so slow endpoints never block matching.
+    Failed deliveries are rescheduled with exponential backoff instead of being retried right away, and
+    deliveries to a throttled endpoint are delayed until its token bucket allows them.
+
+    If a coalesce function is given, it's called with the data of all deliveries due for the same endpoint,
+    and returns the merged data and how many of them it merged.
+    """
+
+    def __init__(self, name, send, workers=4, max_attempts=5, backoff=1.0, max_backoff=60.0, coalesce=None):
+        self.name = name
+        self.send = send
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.coalesce = coalesce
+
+        # (due time, sequence, delivery), the sequence keeps deliveries with the same due time in order
+        self.scheduled = []
+        self.sequence = itertools.count()
+        self.queued = 0
+        self.condition = Condition()
+
+        # with coalescing, the scheduled deliveries of every key too. deliveries merged into another one stay
+        # in scheduled, their sequence numbers are skipped when they come up
+        self.scheduled_by_key = {}
+        self.merged = set()
+        self.active = 0
+        self.threads = []
+
+        self.buckets = {}
+        self.buckets_lock = Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = Thread(target=self.work, name='%s-%d' % (self.name, i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def bucket(self, key):
+        with self.buckets_lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket()
+                self.buckets[key] = bucket
+            return bucket
+
+    def submit(self, key, data):
+        self.schedule(Delivery(key, data), time.time())
+
+    def schedule(self, delivery, due):
+        with self.condition:
+            if not self.threads:
+                self.start()
+
+            entry = (due, next(self.sequence), delivery)
+            heapq.heappush(self.scheduled, entry)
+            if self.coalesce is not None:
+                heapq.heappush(self.scheduled_by_key.setdefault(delivery.key, []), entry)
+            self.queued += 1
+            self.condition.notify_all()
+
+    def take(self):
+        with self.condition:
+            while True:
+                while self.scheduled and self.scheduled[0][1] in self.merged:
+                    self.merged.discard(heapq.heappop(self.scheduled)[1])
+
+                now = time.time()
+                if self.scheduled and self.scheduled[0][0] <= now:
+                    self.active += 1
+                    self.queued -= 1
+                    delivery = heapq.heappop(self.scheduled)[2]
+                    if self.coalesce is not None:
+                        # the earliest of its key as well
+                        self.pop_key(delivery.key)
+                        delivery = self.merge_due(delivery, now)
+                    return delivery
+
+                timeout = self.scheduled[0][0] - now if self.scheduled else None
+                self.condition.wait(timeout)
+
+    def merge_due(self, delivery, now):
+        """
+        Merges other due deliveries for the same endpoint into the given one. Must hold the condition.
+        """
+        due = []
+        pending = self.scheduled_by_key.get(delivery.key)
+        while pending and pending[0][0] <= now:
+            due.append(self.pop_key(delivery.key))
+        if not due:
+            return delivery
+
+        data, merged = self.coalesce([delivery.data] + [entry[2].data for entry in due])
+        used = due[:max(merged - 1, 0)]
+        for entry in due[len(used):]:
+            heapq.heappush(self.scheduled_by_key.setdefault(delivery.key, []), entry)
+        if not used:
+            return delivery
+
+        self.merged.update(entry[1] for entry in used)
+        self.queued -= len(used)
+
+        log.debug('Coalesced %d notifications to %s', merged, delivery.key)
+        combined = Delivery(delivery.key, data)
+        combined.attempts = delivery.attempts
+        return combined
+
+    def pop_key(self, key):
+        pending = self.scheduled_by_key[key]
+        entry = heapq.heappop(pending)
+        if not pending:
+            del self.scheduled_by_key[key]
+        return entry
+
+    def work(self):
+        while True:
+            delivery = self.take()
+            try:
+                self.deliver(delivery)
+            except Exception:
+                log.exception('Unexpected error delivering to %s', delivery.key)
+            finally:
+                with self.condition:
+                    self.active -= 1
+                    self.condition.notify_all()
+
+    def deliver(self, delivery):
+        bucket = self.bucket(delivery.key)
+        wait = bucket.reserve()
+        if wait > 0:
+            log.debug('Delaying notification to %s by %.2fs', delivery.key, wait)
+            self.schedule(delivery, time.time() + wait)
+            return
+
+        timed = metrics.enabled
+        if timed:
+            start = time.time()
+
+        try:
+            sent = self.send(delivery.key, delivery.data)
+        except RateLimited as e:
+            metrics.count('rate_limited', self.name)
+
+            # not a failed attempt, the endpoint only wants us to slow down
+            log.warning('Rate limited by %s for %.2fs', delivery.key, e.retry_after)
+            bucket.block(e.retry_after)
+            self.schedule(delivery, time.time() + e.retry_after)
+            return
+        finally:
+            if timed:
+                metrics.observe('send', self.name, time.time() - start)
+
+        if sent:
+            metrics.count('sent', self.name)
+            return
+
+        metrics.count('send_failed', self.name)
+        delivery.attempts += 1
+        if delivery.attempts >= self.max_attempts:
+            log.error("Failed notification to %s after %d attempts: %s", delivery.key, delivery.attempts,
+                      delivery.data)
+            return
+
+        delay = min(self.backoff * 2 ** (delivery.attempts - 1), self.max_backoff)
+        log.debug('Retrying notification to %s in %.1fs', delivery.key, delay)
+        self.schedule(delivery, time.time() + delay)
+
+    def pending(self):
+        with self.condition:
+            return self.queued + self.active
+
+    def wait(self, timeout=None):
+        """
+        Waits until all deliveries are done, returns False on timeout
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.condition:
+            while self.queued or self.active:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return True
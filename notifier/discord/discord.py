@@ -1,28 +1,68 @@
 from .. import NotificationHandler
 from .. import utils
+from ..delivery import DeliveryPool, RateLimited
+from threading import Lock
 import logging
+import re
 import requests
+import time
 
 log = logging.getLogger(__name__)
 
 
+# Discord allows up to 10 embeds and 2000 characters of content per message
+MAX_EMBEDS = 10
+MAX_CONTENT = 2000
+
+# webhook urls without a version, like the ones discord hands out, use the default api version 6
+API_VERSION = re.compile(r'/api/v(\d+)/')
+DEFAULT_API_VERSION = 6
+
+
 class Discord(NotificationHandler):
-    def notify_pokemon(self, endpoint, pokemon):
-        url = endpoint.get('url')
-        if not url:
-            log.error("No url available to notify to")
-            return
+    def __init__(self, workers=4, coalesce=False):
+        super(Discord, self).__init__()
+
+        # one persistent session per webhook, so connections are reused between notifications
+        self.sessions = {}
+        self.sessions_lock = Lock()
 
-        data = self.create_embedded(pokemon)
+        # without workers, notifications are sent synchronously from the notifier thread
+        self.pool = None
+        if workers > 0:
+            self.pool = DeliveryPool('Discord', self.send, workers, coalesce=self.coalesce if coalesce else None)
 
-        self.try_sending(url, data)
+    def notify_pokemon(self, endpoint, pokemon):
+        self.deliver(endpoint, 'pokemon', self.create_embedded(pokemon))
 
     def notify_gym(self, endpoint, gym):
+        self.deliver(endpoint, 'gym', self.create_gym_embedded(gym))
+
+    def notify_raid(self, endpoint, raid):
+        self.deliver(endpoint, 'raid', self.create_raid_embedded(raid))
+
+    def notify_egg(self, endpoint, egg):
+        self.deliver(endpoint, 'egg', self.create_egg_embedded(egg))
+
+    def render(self, kind, data):
+        if kind == 'pokemon':
+            return self.create_embedded(data)
+        if kind == 'gym':
+            return self.create_gym_embedded(data)
+        if kind == 'raid':
+            return self.create_raid_embedded(data)
+        return self.create_egg_embedded(data)
+
+    def deliver(self, endpoint, kind, payload):
         url = endpoint.get('url')
         if not url:
             log.error("No url available to notify to")
             return
 
+        self.try_sending(url, payload)
+
+    @staticmethod
+    def create_gym_embedded(gym):
         content = '**%s** joined a gym!' % gym.get('trainer_name')
         embed = {
             'title': u"Open Google Maps",
@@ -39,33 +79,11 @@ class Discord(NotificationHandler):
         else:
             embed['description'] = 'Gym Name: %s' % name
 
-        data = {
+        return {
             'content': content,
             'embeds': [embed]
         }
 
-        self.try_sending(url, data)
-
-    def notify_raid(self, endpoint, raid):
-        url = endpoint.get('url')
-        if not url:
-            log.error("No url available to notify to")
-            return
-
-        data = self.create_raid_embedded(raid)
-
-        self.try_sending(url, data)
-
-    def notify_egg(self, endpoint, egg):
-        url = endpoint.get('url')
-        if not url:
-            log.error("No url available to notify to")
-            return
-
-        data = self.create_egg_embedded(egg)
-
-        self.try_sending(url, data)
-
     @staticmethod
     def create_raid_embedded(raid):
         title = '%s raid at %s until %s (%s left)!' % (raid.get('name'),
@@ -189,24 +207,114 @@ class Discord(NotificationHandler):
         }
 
     def try_sending(self, url, data):
+        if self.pool is not None:
+            log.debug('Queueing Discord notification: %s' % data)
+            self.pool.submit(url, data)
+            return True
+
         for i in range(0, 5):
-            log.debug('Notifying Discord: %s' % data)
-            if self.send(url, data):
-                log.info('Discord notified: %s' % data)
-                return True
+            try:
+                if self.send(url, data):
+                    return True
+            except RateLimited as e:
+                log.warning('Rate limited by %s for %.2fs', url, e.retry_after)
+                time.sleep(e.retry_after)
 
         log.error("Failed notification to %s: %s", url, data)
         return False
 
     @staticmethod
-    def send(url, data):
-        try:
-            headers = {'Content-Type': 'application/json'}
+    def coalesce(payloads):
+        """
+        Merges as many of the given payloads as fit into one message
+        """
+        content = []
+        embeds = []
+        length = 0
+        count = 0
+        for payload in payloads:
+            payload_content = payload.get('content')
+            payload_embeds = payload.get('embeds', [])
+            added_length = len(payload_content) + 1 if payload_content else 0
+
+            if count > 0 and (len(embeds) + len(payload_embeds) > MAX_EMBEDS or length + added_length > MAX_CONTENT):
+                break
+
+            if payload_content:
+                content.append(payload_content)
+                length += added_length
+            embeds.extend(payload_embeds)
+            count += 1
+
+        if count == 1:
+            return payloads[0], 1
+
+        return {'content': u'\n'.join(content), 'embeds': embeds}, count
+
+    def get_session(self, url):
+        with self.sessions_lock:
+            session = self.sessions.get(url)
+            if session is None:
+                session = requests.Session()
+                session.headers.update({'Content-Type': 'application/json'})
+                if self.pool is not None:
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool.workers)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                self.sessions[url] = session
+            return session
+
+    def update_rate_limit(self, url, response):
+        if self.pool is None:
+            return
+
+        headers = response.headers
+        limit = headers.get('X-RateLimit-Limit')
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_after = headers.get('X-RateLimit-Reset-After')
+        if reset_after is None and headers.get('X-RateLimit-Reset') is not None:
+            reset_after = max(float(headers['X-RateLimit-Reset']) - time.time(), 0)
 
-            session = requests.Session()
-            session.headers.update(headers)
+        self.pool.bucket(url).update(
+            int(limit) if limit is not None else None,
+            int(remaining) if remaining is not None else None,
+            float(reset_after) if reset_after is not None else None)
 
-            response = session.post(url, json=data, timeout=10)
+    @staticmethod
+    def api_version(url):
+        match = API_VERSION.search(url or '')
+        return int(match.group(1)) if match else DEFAULT_API_VERSION
+
+    @staticmethod
+    def get_retry_after(response):
+        """
+        Returns the number of seconds to wait after a 429 response
+        """
+        # the headers are in seconds with every api version
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None:
+            return float(retry_after)
+
+        reset_after = response.headers.get('X-RateLimit-Reset-After')
+        if reset_after is not None:
+            return float(reset_after)
+
+        try:
+            retry_after = response.json().get('retry_after')
+        except ValueError:
+            retry_after = None
+        if retry_after is None:
+            return 1.0
+
+        # the body reports milliseconds before api version 8, seconds since
+        if Discord.api_version(response.url) < 8:
+            return retry_after / 1000.0
+        return float(retry_after)
+
+    def send(self, url, data):
+        log.debug('Notifying Discord: %s' % data)
+        try:
+            response = self.get_session(url).post(url, json=data, timeout=10)
         except requests.exceptions.ReadTimeout:
             log.warn('Response timed out on discord webhook %s', url)
             return False
@@ -214,8 +322,14 @@ class Discord(NotificationHandler):
             log.exception('Exception posting to discord webhook %s', url)
             return False
 
+        self.update_rate_limit(url, response)
+
+        if response.status_code == 429:
+            raise RateLimited(self.get_retry_after(response))
+
         if response.status_code != 200 and response.status_code != 204:
             log.error("Error: {} {}".format(response.status_code, response.reason))
             return False
 
+        log.info('Discord notified: %s' % data)
         return True
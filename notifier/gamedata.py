@@ -0,0 +1,140 @@
+from array import array
+import bisect
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+_game_data = None
+
+
+class GameData:
+    """
+    Names, moves, base stats and cp multipliers, loaded once and stored in id-indexed arrays
+    """
+
+    def __init__(self, data_dir='data'):
+        names = self.load(data_dir, 'names.json')
+        moves = self.load(data_dir, 'moves.json')
+        stats = self.load(data_dir, 'stats.json')
+        cpm = self.load(data_dir, 'cpm.json')
+
+        self.pokemon_names = self.to_list(names)
+        self.pokemon_ids = {name: pokemon_id for pokemon_id, name in enumerate(self.pokemon_names) if name}
+        self.move_names = self.to_list(moves)
+
+        # base stats, 0 means unknown
+        size = max(int(k) for k in stats) + 1
+        self.stat_names = [None] * size
+        self.base_attack = array('H', [0] * size)
+        self.base_defense = array('H', [0] * size)
+        self.base_stamina = array('H', [0] * size)
+        for pokemon_id, pokemon_stats in stats.items():
+            pokemon_id = int(pokemon_id)
+            self.stat_names[pokemon_id] = pokemon_stats.get('name')
+            self.base_attack[pokemon_id] = pokemon_stats.get('attack')
+            self.base_defense[pokemon_id] = pokemon_stats.get('defense')
+            self.base_stamina[pokemon_id] = pokemon_stats.get('stamina')
+
+        # cp multipliers are indexed by half levels, starting at level 1
+        self.levels = sorted(float(level) for level in cpm)
+        self.cpms = array('d', [0.0] * (self.level_index(self.levels[-1]) + 1))
+        for level, multiplier in cpm.items():
+            self.cpms[self.level_index(float(level))] = multiplier
+
+        # sorted by cp multiplier, for finding the level of a reported multiplier
+        by_cpm = sorted((cpm[level], float(level)) for level in cpm)
+        self.sorted_cpms = [multiplier for multiplier, level in by_cpm]
+        self.sorted_levels = [level for multiplier, level in by_cpm]
+
+        log.info('Loaded %d pokemon, %d moves and %d levels', len(names), len(moves), len(self.levels))
+
+    @staticmethod
+    def load(data_dir, filename):
+        with open('%s/%s' % (data_dir, filename), 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def to_list(data):
+        values = [None] * (max(int(k) for k in data) + 1)
+        for key, value in data.items():
+            values[int(key)] = value
+        return values
+
+    @staticmethod
+    def level_index(level):
+        return int(round(float(level) * 2)) - 2
+
+    @staticmethod
+    def lookup(values, key):
+        try:
+            key = int(key)
+        except (TypeError, ValueError):
+            return None
+
+        if 0 <= key < len(values):
+            return values[key]
+        return None
+
+    def pokemon_name(self, pokemon_id):
+        name = self.lookup(self.pokemon_names, pokemon_id)
+        return name if name is not None else 'unknown'
+
+    def pokemon_id(self, pokemon_name):
+        return self.pokemon_ids.get(pokemon_name, -1)
+
+    def move_name(self, move_id):
+        name = self.lookup(self.move_names, move_id)
+        return name if name is not None else 'unknown'
+
+    def stats(self, pokemon_id):
+        if self.lookup(self.stat_names, pokemon_id) is None:
+            return None
+
+        pokemon_id = int(pokemon_id)
+
+        return {
+            'name': self.stat_names[pokemon_id],
+            'attack': self.base_attack[pokemon_id],
+            'defense': self.base_defense[pokemon_id],
+            'stamina': self.base_stamina[pokemon_id]
+        }
+
+    def cpm_for_level(self, level):
+        """
+        Returns the cp multiplier for the given level, or None if it isn't a valid level
+        """
+        level = float(level)
+        index = self.level_index(level)
+        if index < 0 or index >= len(self.cpms) or (index + 2) / 2.0 != level:
+            return None
+        return self.cpms[index]
+
+    def level_for_cpm(self, cp_multiplier, tolerance=0.0001):
+        """
+        Returns the level with the cp multiplier nearest to the given one, or None if none is within tolerance
+        """
+        i = bisect.bisect_left(self.sorted_cpms, cp_multiplier)
+
+        nearest = None
+        for j in (i - 1, i):
+            if 0 <= j < len(self.sorted_cpms):
+                difference = abs(self.sorted_cpms[j] - cp_multiplier)
+                if difference <= tolerance and (nearest is None or difference < nearest[0]):
+                    nearest = (difference, self.sorted_levels[j])
+
+        if nearest is None:
+            return None
+
+        level = nearest[1]
+        return int(level) if level.is_integer() else level
+
+
+def get_game_data():
+    """
+    Returns the shared GameData instance, loading it on first use
+    """
+    global _game_data
+    if _game_data is None:
+        _game_data = GameData()
+    return _game_data
@@ -0,0 +1,330 @@
+import bisect
+import logging
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+OUTSIDE = 0
+INSIDE = 1
+BOUNDARY = 2
+
+EMPTY = frozenset()
+
+# below this many points in a batch, NumPy's overhead costs more than testing them one by one
+VECTORISE_MIN_POINTS = 16
+
+
+def make_polygon(rng, vertices, center_x, center_y, radius):
+    """
+    Returns a random polygon around the center, for the tests and benchmarks. It's star shaped,
+    so it's concave but never self intersecting.
+    """
+    polygon = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * rng.uniform(0.3, 1.0)
+        polygon.append((center_x + r * math.cos(angle), center_y + r * math.sin(angle)))
+    return polygon
+
+
+def is_inside_edges(edges, x, y):
+    """
+    Ray casting over a list of (x1, y1, x2, y2) edges, using the same rules as utils.is_inside_polygon
+    """
+    inside = False
+    for p1x, p1y, p2x, p2y in edges:
+        if p1y < p2y:
+            min_y, max_y = p1y, p2y
+        else:
+            min_y, max_y = p2y, p1y
+
+        if min_y < y <= max_y and x <= max(p1x, p2x):
+            xints = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+            if p1x == p2x or x <= xints:
+                inside = not inside
+
+    return inside
+
+
+class PreparedPolygon:
+    """
+    A polygon with a grid over its bounding box. Each cell is classified as inside, outside or boundary,
+    and only points in boundary cells are ray cast, against the edges that can cross their ray.
+    The edge list of a boundary cell is stored as the length of a prefix of its strip's edges.
+    """
+
+    def __init__(self, name, polygon):
+        self.name = name
+
+        xs = [p[0] for p in polygon]
+        ys = [p[1] for p in polygon]
+        self.min_x, self.max_x = min(xs), max(xs)
+        self.min_y, self.max_y = min(ys), max(ys)
+
+        self.size = max(4, min(128, int(2 * math.sqrt(len(polygon)))))
+        self.cell_width = (self.max_x - self.min_x) / self.size or 1e-9
+        self.cell_height = (self.max_y - self.min_y) / self.size or 1e-9
+        self.epsilon = 1e-6 * min(self.cell_width, self.cell_height)
+
+        n = len(polygon)
+        self.edges = [polygon[i] + polygon[(i + 1) % n] for i in range(n)]
+
+        self.cells = bytearray(self.size * self.size)
+        self.row_edges = None
+        self.cell_edges = {}
+        self.build()
+
+    def build(self):
+        size = self.size
+        epsilon = self.epsilon
+
+        # edges touching each horizontal strip of cells, and the cells they pass through
+        row_edges = [[] for _ in range(size)]
+        boundary = set()
+        for edge in self.edges:
+            p1x, p1y, p2x, p2y = edge
+            for j in self.span(min(p1y, p2y), max(p1y, p2y), self.min_y, self.cell_height):
+                row_edges[j].append(edge)
+
+                # the part of the edge inside this strip
+                y0 = self.min_y + j * self.cell_height - epsilon
+                y1 = y0 + self.cell_height + 2 * epsilon
+                if p1y == p2y:
+                    xa, xb = p1x, p2x
+                else:
+                    ta = min(max((y0 - p1y) / (p2y - p1y), 0.0), 1.0)
+                    tb = min(max((y1 - p1y) / (p2y - p1y), 0.0), 1.0)
+                    xa = p1x + ta * (p2x - p1x)
+                    xb = p1x + tb * (p2x - p1x)
+
+                for i in self.span(min(xa, xb), max(xa, xb), self.min_x, self.cell_width):
+                    boundary.add((i, j))
+
+        # sorted so that the edges reaching the left side of a cell are a prefix of its strip
+        for edges in row_edges:
+            edges.sort(key=lambda e: max(e[0], e[2]), reverse=True)
+        self.row_edges = row_edges
+
+        for j in range(size):
+            edges = row_edges[j]
+            reach = [-max(e[0], e[2]) for e in edges]
+            for i in range(size):
+                if (i, j) in boundary:
+                    # only edges reaching the left side of the cell can be crossed by a ray from within it
+                    left = self.min_x + i * self.cell_width - epsilon
+                    self.cells[j * size + i] = BOUNDARY
+                    self.cell_edges[j * size + i] = bisect.bisect_right(reach, -left)
+                else:
+                    x = self.min_x + (i + 0.5) * self.cell_width
+                    y = self.min_y + (j + 0.5) * self.cell_height
+                    self.cells[j * size + i] = INSIDE if is_inside_edges(edges, x, y) else OUTSIDE
+
+    def span(self, low, high, origin, cell_size):
+        first = int(math.floor((low - self.epsilon - origin) / cell_size))
+        last = int(math.floor((high + self.epsilon - origin) / cell_size))
+        return range(max(first, 0), min(last, self.size - 1) + 1)
+
+    def contains(self, x, y):
+        if x < self.min_x or x > self.max_x or y < self.min_y or y > self.max_y:
+            return False
+
+        i = min(int((x - self.min_x) / self.cell_width), self.size - 1)
+        j = min(int((y - self.min_y) / self.cell_height), self.size - 1)
+        cell = j * self.size + i
+
+        status = self.cells[cell]
+        if status == BOUNDARY:
+            return is_inside_edges(self.row_edges[j][:self.cell_edges[cell]], x, y)
+        return status == INSIDE
+
+
+class GeofenceIndex:
+    """
+    Prepared polygons for all geofences, bucketed by a coarse grid so that all geofences containing a point
+    can be found with one lookup
+    """
+
+    def __init__(self, geofences):
+        self.polygons = {}
+        for name, geofence in geofences.items():
+            if geofence['polygon']:
+                self.polygons[name] = PreparedPolygon(name, geofence['polygon'])
+
+        self.buckets = {}
+        self.bucket_size = 1.0
+        self.arrays = None
+        if self.polygons:
+            self.build_buckets()
+
+        log.debug('Indexed %d geofences in %d buckets', len(self.polygons), len(self.buckets))
+
+    def build_buckets(self):
+        extents = sorted(max(p.max_x - p.min_x, p.max_y - p.min_y) for p in self.polygons.values())
+
+        # typical geofence size, but never more than 64 buckets across the largest one
+        self.bucket_size = max(extents[len(extents) // 2], extents[-1] / 64) or 1.0
+
+        for polygon in self.polygons.values():
+            min_i, min_j = self.bucket(polygon.min_x, polygon.min_y)
+            max_i, max_j = self.bucket(polygon.max_x, polygon.max_y)
+            for i in range(min_i, max_i + 1):
+                for j in range(min_j, max_j + 1):
+                    self.buckets.setdefault((i, j), []).append(polygon)
+
+    def bucket(self, x, y):
+        return int(math.floor(x / self.bucket_size)), int(math.floor(y / self.bucket_size))
+
+    def contains(self, name, x, y):
+        polygon = self.polygons.get(name)
+        return polygon is not None and polygon.contains(x, y)
+
+    def smallest_at(self, x, y):
+        """
+        Returns the name of the smallest geofence containing the given point, or None
+        """
+        names = self.geofences_at(x, y)
+        if not names:
+            return None
+
+        def area(name):
+            polygon = self.polygons[name]
+            return (polygon.max_x - polygon.min_x) * (polygon.max_y - polygon.min_y), name
+
+        return min(names, key=area)
+
+    def geofences_at(self, x, y):
+        """
+        Returns the names of all geofences containing the given point
+        """
+        if x is None or y is None:
+            return EMPTY
+
+        polygons = self.buckets.get(self.bucket(x, y), ())
+        return frozenset(polygon.name for polygon in polygons if polygon.contains(x, y))
+
+    def geofences_at_many(self, points):
+        """
+        Returns a dict with the names of all geofences containing each of the given (x, y) points
+        """
+        result = {}
+        valid = []
+        for point in points:
+            if point[0] is None or point[1] is None:
+                result[point] = EMPTY
+            else:
+                valid.append(point)
+
+        if numpy is not None and len(valid) >= VECTORISE_MIN_POINTS:
+            names = self.names_at_many(valid)
+        else:
+            names = self.names_by_bucket(valid)
+
+        result.update(zip(valid, map(frozenset, names)))
+        return result
+
+    def names_by_bucket(self, points):
+        """
+        Lists the names of the geofences containing each point, testing the points of a bucket one polygon at a time
+        """
+        names = [[] for _ in points]
+        groups = {}
+        for k, (x, y) in enumerate(points):
+            groups.setdefault(self.bucket(x, y), []).append(k)
+
+        for key, group in groups.items():
+            for polygon in self.buckets.get(key, ()):
+                min_x, max_x, min_y, max_y = polygon.min_x, polygon.max_x, polygon.min_y, polygon.max_y
+                for k in group:
+                    x, y = points[k]
+                    if min_x <= x <= max_x and min_y <= y <= max_y and polygon.contains(x, y):
+                        names[k].append(polygon.name)
+
+        return names
+
+    def names_at_many(self, points):
+        """
+        Vectorised names_by_bucket. Points are grouped by bucket, and every point is paired with the candidate
+        polygons of its bucket only. The bounding box and cell of all pairs are looked up at once, only pairs
+        in boundary cells are ray cast one by one.
+        """
+        if self.arrays is None:
+            self.build_arrays()
+        order, candidates, min_x, max_x, min_y, max_y, cell_width, cell_height, size, offset, cells = self.arrays
+
+        xs = numpy.array([point[0] for point in points], dtype=numpy.float64)
+        ys = numpy.array([point[1] for point in points], dtype=numpy.float64)
+
+        # same buckets as self.bucket, each one looked up once
+        bucket_i = numpy.floor(xs / self.bucket_size).astype(numpy.int64)
+        bucket_j = numpy.floor(ys / self.bucket_size).astype(numpy.int64)
+        _, first, inverse = numpy.unique(bucket_i * (1 << 32) + bucket_j, return_index=True, return_inverse=True)
+
+        flat = []
+        starts = []
+        counts = []
+        for key in zip(bucket_i[first].tolist(), bucket_j[first].tolist()):
+            polygons = candidates.get(key, ())
+            starts.append(len(flat))
+            counts.append(len(polygons))
+            flat.extend(polygons)
+
+        names = [[] for _ in points]
+        if not flat:
+            return names
+
+        # one (point, polygon) pair for every candidate polygon of every point
+        counts = numpy.array(counts)[inverse]
+        starts = numpy.array(starts)[inverse]
+        pair_points = numpy.repeat(numpy.arange(len(points)), counts)
+        position = numpy.arange(len(pair_points)) - (numpy.cumsum(counts) - counts)[pair_points]
+        pair_polygons = numpy.array(flat)[starts[pair_points] + position]
+
+        x = xs[pair_points]
+        y = ys[pair_points]
+        keep = numpy.nonzero((x >= min_x[pair_polygons]) & (x <= max_x[pair_polygons]) &
+                             (y >= min_y[pair_polygons]) & (y <= max_y[pair_polygons]))[0]
+        pair_points = pair_points[keep]
+        pair_polygons = pair_polygons[keep]
+        x = x[keep]
+        y = y[keep]
+
+        # same cells as PreparedPolygon.contains
+        sizes = size[pair_polygons]
+        i = numpy.minimum(((x - min_x[pair_polygons]) / cell_width[pair_polygons]).astype(int), sizes - 1)
+        j = numpy.minimum(((y - min_y[pair_polygons]) / cell_height[pair_polygons]).astype(int), sizes - 1)
+        status = cells[offset[pair_polygons] + j * sizes + i]
+
+        inside = status == INSIDE
+        for k, polygon in zip(pair_points[inside].tolist(), pair_polygons[inside].tolist()):
+            names[k].append(order[polygon].name)
+
+        boundary = status == BOUNDARY
+        for k, polygon in zip(pair_points[boundary].tolist(), pair_polygons[boundary].tolist()):
+            if order[polygon].contains(points[k][0], points[k][1]):
+                names[k].append(order[polygon].name)
+
+        return names
+
+    def build_arrays(self):
+        """
+        Flattens the polygons into NumPy arrays for names_at_many, with the buckets as lists of polygon positions
+        """
+        order = [self.polygons[name] for name in sorted(self.polygons)]
+        positions = dict((polygon.name, k) for k, polygon in enumerate(order))
+        candidates = dict((key, [positions[polygon.name] for polygon in polygons])
+                          for key, polygons in self.buckets.items())
+
+        def column(attribute):
+            return numpy.array([getattr(polygon, attribute) for polygon in order], dtype=numpy.float64)
+
+        size = numpy.array([polygon.size for polygon in order], dtype=numpy.int64)
+        offset = numpy.cumsum(size * size) - size * size
+        cells = numpy.frombuffer(bytes(bytearray().join(polygon.cells for polygon in order)), dtype=numpy.uint8)
+
+        self.arrays = (order, candidates, column('min_x'), column('max_x'), column('min_y'), column('max_y'),
+                       column('cell_width'), column('cell_height'), size, offset, cells)
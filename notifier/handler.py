@@ -1,55 +1,112 @@
 from .utils import *
+from .cptable import CpTable
+from .dedup import CompactDedupTable, ExpiringSet
+from .metrics import metrics
+from .profiler import RuleProfiler
+import time
 import logging
 
 log = logging.getLogger(__name__)
 
 
 class Handler:
-    def __init__(self, config, notifier):
+    def __init__(self, config, notifier, game_data=None):
         self.config = config
         self.notifier = notifier
+        self.game_data = game_data if game_data is not None else get_game_data()
 
-        self.processed_pokemons = {}
-        self.processed_raids = {}
-        self.processed_eggs = {}
+        self.processed_pokemons = CompactDedupTable(config.dedup_capacity)
+        self.processed_raids = ExpiringSet()
+        self.processed_eggs = ExpiringSet()
         self.gyms = {}
 
+        self.profiler = RuleProfiler() if config.profile_rules else None
+
+        # geofences containing each point, so they're only resolved once per message or batch
+        self.geofence_sets = {}
+
+        self.cp_table = None
+        self.init_cp_table()
+
+    def init_cp_table(self):
+        if not self.config.cp_table:
+            self.cp_table = None
+            return
+
+        # the table only depends on the game data, so entries stay valid when the rules change
+        if self.cp_table is None:
+            self.cp_table = CpTable(self.game_data)
+        if self.config.cp_table == 'preload':
+            self.preload_cp_table()
+
+    def set_config(self, config):
+        """
+        Switches to a new config between batches, keeping the dedup stores and gym state
+        """
+        self.config = config
+        self.geofence_sets = {}
+        self.init_cp_table()
+
+        # the profile of the old rules would be mixed up with the new ones
+        self.profiler = RuleProfiler() if config.profile_rules else None
+
+    def preload_cp_table(self):
+        pokemon_ids = set()
+        levels = set()
+        index = self.config.pokemon_index
+
+        buckets = [(pokemon_id, bucket) for pokemon_id, bucket in index.species.items()]
+        buckets.append((None, index.wildcard))
+        for pokemon_id, rules in buckets:
+            for rule in rules:
+                for key in ('min_cp', 'max_cp', 'min_hp', 'max_hp'):
+                    for level in rule.rules.get(key, {}):
+                        levels.add(float(level))
+                        if pokemon_id is None:
+                            # wildcard rules can match any species
+                            pokemon_ids.update(range(len(self.game_data.stat_names)))
+                        else:
+                            pokemon_ids.add(pokemon_id)
+
+        self.cp_table.preload(sorted(pokemon_ids), sorted(levels))
+
+    def get_cp(self, pokemon_id, level, iv_attack, iv_defense, iv_stamina):
+        if self.cp_table is not None:
+            return self.cp_table.cp(pokemon_id, level, iv_attack, iv_defense, iv_stamina)
+        return get_cp_for_level(pokemon_id, level, iv_attack, iv_defense, iv_stamina)
+
+    def get_hp(self, pokemon_id, level, iv_stamina):
+        if self.cp_table is not None:
+            return self.cp_table.hp(pokemon_id, level, iv_stamina)
+        return get_hp_for_level(pokemon_id, level, iv_stamina)
+
     def clean(self):
-        now = datetime.datetime.utcnow()
-        remove = []
-
-        for encounter_id in self.processed_pokemons:
-            if self.processed_pokemons[encounter_id] < now:
-                remove.append(encounter_id)
-        for encounter_id in remove:
-            del self.processed_pokemons[encounter_id]
-
-        remove = []
-        for key in self.processed_raids:
-            if self.processed_raids[key] < now:
-                remove.append(key)
-        for key in remove:
-            del self.processed_raids[key]
-
-        remove = []
-        for key in self.processed_eggs:
-            if self.processed_eggs[key] < now:
-                remove.append(key)
-        for key in remove:
-            del self.processed_eggs[key]
+        now = time.time()
+        self.processed_pokemons.expire(now)
+        self.processed_raids.expire(now)
+        self.processed_eggs.expire(now)
+
+    def cp_table_stats(self):
+        return self.cp_table.stats() if self.cp_table is not None else None
+
+    def dedup_stats(self):
+        return {
+            'pokemons': self.processed_pokemons.stats(),
+            'raids': self.processed_raids.stats(),
+            'eggs': self.processed_eggs.stats()
+        }
 
     def handle_pokemon(self, message):
         if message['encounter_id'] in self.processed_pokemons:
             log.debug('Encounter ID %s already processed.', message['encounter_id'])
             return
 
-        self.processed_pokemons[message['encounter_id']] = \
-            datetime.datetime.utcfromtimestamp(message['disappear_time'])
+        self.processed_pokemons.add(message['encounter_id'], message['disappear_time'])
 
         # initialize the pokemon dict
         pokemon = {
             'id': message['pokemon_id'],
-            'name': get_pokemon_name(message['pokemon_id']),
+            'name': self.game_data.pokemon_name(message['pokemon_id']),
             'lat': message['latitude'],
             'lon': message['longitude']
         }
@@ -59,6 +116,10 @@ class Handler:
 
         if message.get('pokemon_level') is not None:
             pokemon['level'] = message['pokemon_level']
+        elif message.get('cp_multiplier') is not None:
+            level = self.game_data.level_for_cpm(message['cp_multiplier'])
+            if level is not None:
+                pokemon['level'] = level
 
         if message.get('form') is not None:
             pokemon['form'] = chr(message['form'] + 64)
@@ -77,36 +138,42 @@ class Handler:
         # add moves to pokemon dict if found
         move_1, move_2 = None, None
         if message.get('move_1') is not None:
-            move_1 = get_move_name(message['move_1'])
+            move_1 = self.game_data.move_name(message['move_1'])
         if message.get('move_2') is not None:
-            move_2 = get_move_name(message['move_2'])
+            move_2 = self.game_data.move_name(message['move_2'])
 
         if move_1 is not None:
             pokemon['move_1'] = move_1
         if move_2 is not None:
             pokemon['move_2'] = move_2
 
-        to_notify = set([])
+        timed = metrics.enabled
+        if timed:
+            start = time.time()
 
-        # Loop through all active includes and send notifications if appropriate
-        for include_ref in self.config.pokemon_includes:
-            include = self.config.pokemon_includes.get(include_ref)
-            match = self.is_included_pokemon(pokemon, include)
+        to_notify = {}
+        matched_includes = set([])
 
-            if match:
-                notification_setting_refs = self.config.pokemon_includes_to_notifications.get(include_ref)
+        # Only check the rules that can match this pokemon, as found by the compiled index
+        for rule in self.config.pokemon_index.candidates(pokemon['id']):
+            if rule.include_ref in matched_includes:
+                continue
 
-                if notification_setting_refs is not None:
-                    for notification_setting_ref in notification_setting_refs:
-                        to_notify.add(notification_setting_ref)
-            else:
-                log.debug('No match for %s in %s', pokemon['name'], include_ref)
+            if not self.rule_matches(pokemon, rule):
+                continue
+
+            matched_includes.add(rule.include_ref)
+            for target in self.config.pokemon_dispatch.get(rule.include_ref, ()):
+                to_notify[target[1]] = target
+
+        if timed:
+            metrics.observe('match', 'pokemon', time.time() - start)
+            if to_notify:
+                metrics.count('matched', 'pokemon')
 
         if to_notify:
-            log.info('Notifying to %s', to_notify)
-            for notification_setting_ref in to_notify:
-                notification_setting = self.config.notification_settings.get(notification_setting_ref)
-                self.notifier.notify_pokemon(pokemon, message, notification_setting)
+            log.info('Notifying to %s', sorted(to_notify))
+            self.notifier.notify_pokemon(pokemon, message, [to_notify[ref] for ref in sorted(to_notify)])
 
     def handle_gym_details(self, message):
         parsed_gym = message['id']
@@ -127,10 +194,7 @@ class Handler:
         gym = self.gyms[parsed_gym]
         trainers = [p['trainer_name'] for p in message['pokemon']]
 
-        for notification_settings in self.config.notification_settings.itervalues():
-            if not notification_settings.get('gym'):
-                continue
-
+        if self.config.gym_dispatch:
             for tracked_trainer_name in self.config.trainers:
 
                 if tracked_trainer_name in trainers:
@@ -155,7 +219,7 @@ class Handler:
                                                                          self.config.google_key)
                         }
                         log.info("%s joined gym: %s", tracked_trainer_name, gym['name'])
-                        self.notifier.notify_gym(data, notification_settings)
+                        self.notifier.notify_gym(data, self.config.gym_dispatch)
 
         # finally update the gym for next time
         self.gyms[parsed_gym] = {
@@ -174,12 +238,12 @@ class Handler:
             if key in self.processed_eggs:
                 log.debug('Egg [%s] already processed.', key)
                 return
-            self.processed_eggs[key] = datetime.datetime.utcfromtimestamp(message['end'])
+            self.processed_eggs.add(key, message['end'])
         else:
             if key in self.processed_raids:
                 log.debug('Raid [%s] already processed.', key)
                 return
-            self.processed_raids[key] = datetime.datetime.utcfromtimestamp(message['end'])
+            self.processed_raids.add(key, message['end'])
 
         raid = {
             'lat': message['latitude'],
@@ -197,64 +261,61 @@ class Handler:
             raid['name'] = "Egg"
         else:
             raid['id'] = message['pokemon_id']
-            raid['name'] = get_pokemon_name(message['pokemon_id'])
+            raid['name'] = self.game_data.pokemon_name(message['pokemon_id'])
             raid['cp'] = message['cp']
-            raid['move_1'] = get_move_name(message['move_1'])
-            raid['move_2'] = get_move_name(message['move_2'])
+            raid['move_1'] = self.game_data.move_name(message['move_1'])
+            raid['move_2'] = self.game_data.move_name(message['move_2'])
+
+        timed = metrics.enabled
+        if timed:
+            start = time.time()
 
-        to_notify = set([])
+        to_notify = {}
 
         # Loop through all active includes and send notifications if appropriate
         for include_ref in self.config.raid_includes:
             include = self.config.raid_includes.get(include_ref)
-            match = self.is_included_raid(raid, include)
+            match = self.is_included_raid(raid, include, include_ref)
 
             if match:
-                notification_setting_refs = self.config.raid_includes_to_notifications.get(include_ref)
-
-                if notification_setting_refs is not None:
-                    for notification_setting_ref in notification_setting_refs:
-                        to_notify.add(notification_setting_ref)
+                for target in self.config.raid_dispatch.get(include_ref, ()):
+                    to_notify[target[1]] = target
             else:
                 log.debug('No match for %s in %s', raid['name'], include_ref)
 
-        if to_notify:
-            log.info('Notifying %s to %s', "egg" if egg else "raid", to_notify)
-            for notification_setting_ref in to_notify:
-                notification_setting = self.config.notification_settings.get(notification_setting_ref)
-                self.notifier.notify_raid_or_egg(raid, notification_setting)
+        if timed:
+            metrics.observe('match', 'egg' if egg else 'raid', time.time() - start)
+            if to_notify:
+                metrics.count('matched', 'egg' if egg else 'raid')
 
-    def is_included_pokemon(self, pokemon, included_list):
-        matched = False
-        for included_pokemon in included_list:
-            match = self.pokemon_matches(pokemon, included_pokemon)
-            if match[0]:
-                log.info(u"Found match for {} with rules: {}".format(pokemon['name'], match[1]))
-                matched = True
-
-        return matched
+        if to_notify:
+            log.info('Notifying %s to %s', "egg" if egg else "raid", sorted(to_notify))
+            self.notifier.notify_raid_or_egg(raid, [to_notify[ref] for ref in sorted(to_notify)])
 
     def raid_matches(self, raid, rules):
+        """
+        Returns (True, match_data) if the rules match the raid, or (False, first failing predicate)
+        """
         match_data = []
 
         egg = raid['egg']
 
         if egg and not rules.get('egg', True):
-            return False, None
+            return False, 'egg'
 
         if not egg and not rules.get('raid', True):
-            return False, None
+            return False, 'raid'
 
         levels = rules.get('levels')
         if levels is not None:
             if raid['level'] not in levels:
-                return False, None
+                return False, 'levels'
 
             match_data.append('levels')
 
         if 'geofence' in rules:
             if not self.is_inside_geofence(rules['geofence'], raid.get('lat'), raid.get('lon')):
-                return False, None
+                return False, 'geofence'
 
             match_data.append('geofence')
 
@@ -265,7 +326,7 @@ class Handler:
                 name = pokemon_rules.get('name')
                 if name is not None:
                     if name != raid['name']:
-                        return False, None
+                        return False, 'name'
                     else:
                         match_data.append('name')
 
@@ -273,14 +334,14 @@ class Handler:
                 min_cp = pokemon_rules.get('min_cp')
                 if min_cp is not None:
                     if raid['cp'] < min_cp:
-                        return False, None
+                        return False, 'min_cp'
 
                     match_data.append('min_cp')
 
                 max_cp = pokemon_rules.get('max_cp')
                 if max_cp is not None:
                     if raid['cp'] > max_cp:
-                        return False, None
+                        return False, 'max_cp'
 
                     match_data.append('max_cp')
 
@@ -296,80 +357,64 @@ class Handler:
                             moves_match = True
                             break
                     if not moves_match:
-                        return False, None
+                        return False, 'moves'
 
                     match_data.append('moves')
 
         return True, match_data
 
-    def pokemon_matches(self, pokemon, pokemon_rules):
-        match_data = []
-
-        # check name. if name specification doesn't exist, it counts as valid
-        name = pokemon_rules.get('name')
-        if name is not None:
-            if name != pokemon['name']:
-                return False, None
-            else:
-                match_data.append('name')
-
-        # check latitude
-        if not Handler.check_min_max('lat', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check longitude
-        if not Handler.check_min_max('lon', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check id
-        if not Handler.check_min_max('id', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check iv
-        if not Handler.check_min_max('iv', pokemon_rules, pokemon, match_data):
-            return False, None
+    def rule_matches(self, pokemon, rule):
+        """
+        Returns True if the compiled rule matches the given pokemon
+        """
+        if self.profiler is not None:
+            start = time.time()
 
-        # check attack
-        if not Handler.check_min_max('attack', pokemon_rules, pokemon, match_data):
-            return False, None
+        match_data = None
+        failed = rule.matches_thresholds(pokemon)
+        if failed is None:
+            match_data = rule.match_data()
+            if rule.has_extra and not self.extra_checks(pokemon, rule.rules, match_data):
+                failed = rule.failed_extra(match_data)
 
-        # check defense
-        if not Handler.check_min_max('defense', pokemon_rules, pokemon, match_data):
-            return False, None
+        if self.profiler is not None:
+            self.profiler.record('pokemon', rule.include_ref, rule.index, time.time() - start, failed)
 
-        # check stamina
-        if not Handler.check_min_max('stamina', pokemon_rules, pokemon, match_data):
-            return False, None
+        if failed is not None:
+            return False
 
-        # check level (raids)
-        if not Handler.check_min_max('level', pokemon_rules, pokemon, match_data):
-            return False, None
+        log.info(u"Found match for {} with rules: {}".format(pokemon['name'], match_data))
+        return True
 
+    def extra_checks(self, pokemon, pokemon_rules, match_data):
+        """
+        Checks cp, hp, moves and geofence rules, which can't be expressed as simple thresholds
+        """
         # check cp at level
         min_cp = pokemon_rules.get('min_cp')
         if min_cp is not None:
             if 'attack' not in pokemon or 'defense' not in pokemon or 'stamina' not in pokemon:
-                return False, None
+                return False
 
             for level in min_cp:
                 required_cp = min_cp[level]
-                cp = get_cp_for_level(pokemon['id'], int(level), pokemon['attack'], pokemon['defense'],
-                                      pokemon['stamina'])
+                cp = self.get_cp(pokemon['id'], float(level), pokemon['attack'], pokemon['defense'],
+                                 pokemon['stamina'])
                 if cp < required_cp:
-                    return False, None
+                    return False
 
             match_data.append('min_cp')
 
         max_cp = pokemon_rules.get('max_cp')
         if max_cp is not None:
             if 'attack' not in pokemon or 'defense' not in pokemon or 'stamina' not in pokemon:
-                return False, None
+                return False
 
             for level in max_cp:
                 required_cp = max_cp[level]
-                cp = get_cp_for_level(pokemon['id'], level, pokemon['attack'], pokemon['defense'], pokemon['stamina'])
+                cp = self.get_cp(pokemon['id'], float(level), pokemon['attack'], pokemon['defense'], pokemon['stamina'])
                 if cp < required_cp:
-                    return False, None
+                    return False
 
             match_data.append('max_cp')
 
@@ -377,26 +422,26 @@ class Handler:
         min_hp = pokemon_rules.get('min_hp')
         if min_hp is not None:
             if 'stamina' not in pokemon:
-                return False, None
+                return False
 
             for level in min_hp:
                 required_hp = min_hp[level]
-                hp = get_hp_for_level(pokemon['id'], int(level), pokemon['stamina'])
+                hp = self.get_hp(pokemon['id'], float(level), pokemon['stamina'])
                 if hp < required_hp:
-                    return False, None
+                    return False
 
             match_data.append('min_hp')
 
         max_hp = pokemon_rules.get('max_hp')
         if max_hp is not None:
             if 'stamina' not in pokemon:
-                return False, None
+                return False
 
             for level in max_hp:
                 required_hp = max_hp[level]
-                hp = get_hp_for_level(pokemon['id'], level, pokemon['stamina'])
+                hp = self.get_hp(pokemon['id'], float(level), pokemon['stamina'])
                 if hp < required_hp:
-                    return False, None
+                    return False
 
             match_data.append('max_hp')
 
@@ -413,56 +458,27 @@ class Handler:
                     moves_match = True
                     break
             if not moves_match:
-                return False, None
+                return False
 
             match_data.append('moves')
 
         if 'geofence' in pokemon_rules:
             if not self.is_inside_geofence(pokemon_rules['geofence'], pokemon.get('lat'), pokemon.get('lon')):
-                return False, None
+                return False
 
             match_data.append('geofence')
 
-        # Passed all checks. This pokemon matches!
-        return True, match_data
-
-    @staticmethod
-    def check_min(config_key, included_pokemon, message_key, pokemon, match_data):
-        required_value = included_pokemon.get(config_key)
-        if required_value is None:
-            return True
-
-        pokemon_value = pokemon.get(message_key, -1)
-        if pokemon_value < required_value:
-            return False
-
-        match_data.append(config_key)
         return True
 
-    @staticmethod
-    def check_max(config_key, included_pokemon, message_key, pokemon, match_data):
-        required_value = included_pokemon.get(config_key)
-        if required_value is None:
-            return True
-
-        pokemon_value = pokemon.get(message_key, 99999)
-        if pokemon_value > required_value:
-            return False
+    def is_included_raid(self, raid, included_list, include_ref=None):
+        if self.profiler is not None:
+            start = time.time()
 
-        match_data.append(config_key)
-        return True
+        match = self.raid_matches(raid, included_list)
 
-    @staticmethod
-    def check_min_max(key, included_pokemon, pokemon, match_data):
-        """
-        Returns True if included_pokemon matches the given pokemon
-        """
-        check_min = Handler.check_min('min_' + key, included_pokemon, key, pokemon, match_data)
-        check_max = Handler.check_max('max_' + key, included_pokemon, key, pokemon, match_data)
-        return check_min and check_max
+        if self.profiler is not None:
+            self.profiler.record('raid', include_ref, 0, time.time() - start, None if match[0] else match[1])
 
-    def is_included_raid(self, raid, included_list):
-        match = self.raid_matches(raid, included_list)
         if match[0]:
             log.info(
                 u"Found raid match for {} with rules: {}".format("Egg" if raid['egg'] else raid['name'], match[1]))
@@ -471,19 +487,31 @@ class Handler:
         return False
 
     def is_inside_geofence(self, geofence_name, lat, lon):
-        geofence = self.config.geofences.get(geofence_name)
-        if geofence is None:
-            log.warning("geofence {} not found", geofence_name)
+        if geofence_name not in self.config.geofences:
+            log.warning("geofence %s not found", geofence_name)
             return False
 
-        # fast boundaries check
-        boundaries = geofence['boundaries']
-        min_x = boundaries['min'][0]
-        min_y = boundaries['min'][1]
-        max_x = boundaries['max'][0]
-        max_y = boundaries['max'][1]
+        names = self.geofence_sets.get((lat, lon))
+        if names is None:
+            names = self.config.geofence_index.geofences_at(lat, lon)
+            self.geofence_sets[(lat, lon)] = names
 
-        if lat < min_x or lat > max_x or lon < min_y or lon > max_y:
-            return False
+        return geofence_name in names
+
+    def prime_geofences(self, frames):
+        """
+        Resolves the geofences of all pokemon and raids in a batch of frames in one pass
+        """
+        self.geofence_sets = {}
+        if not self.config.uses_geofences or not self.config.geofence_index.polygons:
+            return
+
+        points = set()
+        for frame in frames:
+            if frame.get('type') in ('pokemon', 'raid'):
+                message = frame.get('message', {})
+                if message.get('latitude') is not None and message.get('longitude') is not None:
+                    points.add((message['latitude'], message['longitude']))
 
-        return is_inside_polygon(geofence['polygon'], lat, lon)
+        if points:
+            self.geofence_sets = self.config.geofence_index.geofences_at_many(points)
@@ -0,0 +1,255 @@
+from collections import deque
+from threading import Condition
+import logging
+import Queue
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+log = logging.getLogger(__name__)
+
+WHITESPACE = ' \t\n\r'
+
+POLICIES = ('drop_oldest', 'drop_expired', 'prioritise_raids', 'reject')
+
+# frames of other types are dropped at ingest, nothing else may reach the notifier from a webhook
+MESSAGE_TYPES = ('pokemon', 'gym_details', 'raid')
+
+
+class QueueFull(Exception):
+    """
+    Raised when a frame is rejected because the ingest queue is full
+    """
+    pass
+
+
+def frame_expiry(data):
+    """
+    Returns the time a frame stops being interesting, or None if it never expires
+    """
+    message = data.get('message', {})
+    message_type = data.get('type')
+    if message_type == 'pokemon':
+        return message.get('disappear_time')
+    if message_type == 'raid':
+        return message.get('end')
+    return None
+
+
+def iter_frames(stream, length=None, chunk_size=65536):
+    """
+    Decodes a json frame, or an array of frames, from a file like object while it's being read,
+    yielding every frame as soon as it's complete. At most length bytes are read, if given.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    remaining = length
+    exhausted = False
+    in_array = None
+
+    while True:
+        # skip whitespace, and the separators between frames of an array
+        while position < len(buffer) and (buffer[position] in WHITESPACE or (in_array and buffer[position] == ',')):
+            position += 1
+
+        if position < len(buffer):
+            if in_array is None:
+                in_array = buffer[position] == '['
+                if in_array:
+                    position += 1
+                    continue
+
+            if in_array and buffer[position] == ']':
+                return
+
+            try:
+                frame, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # most likely the frame continues in the next chunk
+                if exhausted:
+                    raise
+            else:
+                # a number at the very end of the buffer may continue in the next chunk too
+                if end < len(buffer) or exhausted:
+                    yield frame
+                    if not in_array:
+                        return
+
+                    # drop the decoded part, so the buffer never holds much more than a chunk
+                    position = end
+                    if position > chunk_size:
+                        buffer = buffer[position:]
+                        position = 0
+                    continue
+        elif exhausted:
+            if in_array:
+                raise ValueError('Unexpected end of json stream')
+            return
+
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        chunk = stream.read(size) if size > 0 else ''
+        if not chunk:
+            exhausted = True
+            continue
+
+        buffer += chunk
+        if remaining is not None:
+            remaining -= len(chunk)
+
+
+class ExpiryFilter:
+    """
+    Drops frames that expire within the given number of seconds, before they're queued for matching
+    """
+
+    def __init__(self, min_pokemon_time_left=0, min_raid_time_left=0):
+        self.min_pokemon_time_left = min_pokemon_time_left
+        self.min_raid_time_left = min_raid_time_left
+        self.dropped = {'pokemon': 0, 'raid': 0}
+
+    def accept(self, data, now=None):
+        expiry = frame_expiry(data)
+        if expiry is None:
+            return True
+
+        message_type = data.get('type')
+        if message_type == 'pokemon':
+            min_time_left = self.min_pokemon_time_left
+        else:
+            min_time_left = self.min_raid_time_left
+
+        now = time.time() if now is None else now
+        if expiry - now >= min_time_left:
+            return True
+
+        self.dropped[message_type] += 1
+        return False
+
+    def stats(self):
+        return dict(self.dropped)
+
+
+class IngestQueue:
+    """
+    Queue of frames waiting to be matched, with a maximum depth. When full, the policy decides what is shed:
+
+    drop_oldest: the oldest queued frame
+    drop_expired: all queued frames that expired already, or the oldest if none did
+    prioritise_raids: the oldest queued pokemon, so raids and gyms are kept
+    reject: nothing, the new frame is refused with QueueFull
+
+    If nothing queued can make room for the new frame, the new frame itself is dropped.
+    A max_size of 0 means the queue is unbounded.
+
+    Looking for expired frames takes a pass over the whole queue, so drop_expired does it at most once
+    every sweep_interval seconds, and drops the oldest frame in between.
+    """
+
+    def __init__(self, max_size=0, policy='drop_oldest', sweep_interval=1.0):
+        if policy not in POLICIES:
+            raise RuntimeError('Unknown queue policy: %s' % policy)
+
+        self.max_size = max_size
+        self.policy = policy
+        self.sweep_interval = sweep_interval
+        self.last_sweep = 0.0
+        self.frames = deque()
+        self.condition = Condition()
+        self.shed = {'oldest': 0, 'expired': 0, 'pokemon': 0, 'incoming': 0, 'rejected': 0}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def configure(self, max_size, policy):
+        # queued frames are kept, a queue over the new max_size doesn't take any more until it drained
+        if policy not in POLICIES:
+            raise RuntimeError('Unknown queue policy: %s' % policy)
+
+        with self.condition:
+            self.max_size = max_size
+            self.policy = policy
+
+    def put(self, data):
+        with self.condition:
+            if self.max_size and len(self.frames) >= self.max_size and not self.make_room(data):
+                if self.policy == 'reject':
+                    self.shed['rejected'] += 1
+                    raise QueueFull()
+
+                self.shed['incoming'] += 1
+                return
+
+            self.frames.append(data)
+            self.condition.notify()
+
+    def make_room(self, data):
+        """
+        Sheds queued frames according to the policy, returns False if there is still no room
+        """
+        if self.policy == 'drop_oldest':
+            self.frames.popleft()
+            self.shed['oldest'] += 1
+
+        elif self.policy == 'drop_expired':
+            now = time.time()
+            if now - self.last_sweep >= self.sweep_interval:
+                self.last_sweep = now
+                queued = len(self.frames)
+                self.frames = deque(frame for frame in self.frames if not self.expired(frame, now))
+                self.shed['expired'] += queued - len(self.frames)
+
+            if len(self.frames) >= self.max_size:
+                self.frames.popleft()
+                self.shed['oldest'] += 1
+
+        elif self.policy == 'prioritise_raids':
+            for i, frame in enumerate(self.frames):
+                if frame.get('type') == 'pokemon':
+                    del self.frames[i]
+                    self.shed['pokemon'] += 1
+                    return True
+
+            # only raids and gyms queued, make room for another one of them
+            if data.get('type') == 'pokemon':
+                return False
+
+            self.frames.popleft()
+            self.shed['oldest'] += 1
+
+        else:
+            return False
+
+        return True
+
+    @staticmethod
+    def expired(data, now):
+        expiry = frame_expiry(data)
+        return expiry is not None and expiry <= now
+
+    def get(self, block=True, timeout=None):
+        with self.condition:
+            if block:
+                deadline = time.time() + timeout if timeout is not None else None
+                while not self.frames:
+                    remaining = deadline - time.time() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+            if not self.frames:
+                raise Queue.Empty()
+
+            return self.frames.popleft()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self.shed)
+            stats['size'] = len(self.frames)
+            return stats
@@ -1,46 +1,188 @@
-from threading import Thread
+from threading import Lock, Thread
 from .config import Config
 from .handler import Handler
+from .ingest import MESSAGE_TYPES, ExpiryFilter, IngestQueue, QueueFull
+from .metrics import metrics
 from .notifier import Notifier
+from .reload import ConfigReloader, format_changes, restart_settings
 from .utils import *
+import copy
 import logging
 import Queue
+import time
 
 log = logging.getLogger(__name__)
 
 
 class NotifierManager(Thread):
-    def __init__(self, config_file):
+    def __init__(self, config_file, queue=None, watch=True):
         super(NotifierManager, self).__init__()
 
         self.daemon = True
         self.name = "Notifier"
 
+        self.game_data = get_game_data()
+        # Config resolves a config dict in place, reloads need it untouched
+        source = copy.deepcopy(config_file)
         self.config = Config(config_file)
-        self.notifier = Notifier(self.config)
-        self.handler = Handler(self.config, self.notifier)
+        if self.config.metrics:
+            metrics.enabled = True
 
-        self.queue = Queue.Queue()
+        self.notifier = Notifier(self.config, self.game_data)
+        self.handler = Handler(self.config, self.notifier, self.game_data)
+
+        # a reloaded config is built by the reloader thread, and swapped in between batches
+        self.pending_config = None
+        self.pending_lock = Lock()
+        self.reloader = ConfigReloader(source, self.config, self.config_reloaded,
+                                       self.config.reload_interval if watch else 0)
+
+        if queue is None:
+            queue = IngestQueue(self.config.queue_size, self.config.queue_policy)
+        self.queue = queue
+        self.expiry_filter = ExpiryFilter(self.config.min_pokemon_time_left, self.config.min_raid_time_left)
+        metrics.register('ingest', self.ingest_stats)
+        metrics.register('dedup', self.handler.dedup_stats)
+        metrics.register('cp_table', self.handler.cp_table_stats)
+
+    def ingest_stats(self):
+        # frames shed or rejected by the queue, and dropped before it because they expire too soon
+        stats = {'expired': self.expiry_filter.stats()}
+        if isinstance(self.queue, IngestQueue):
+            stats['queue'] = self.queue.stats()
+        return stats
+
+    def stop(self):
+        # the notifier thread is a daemon, only what's kept on disk has to be saved
+        self.notifier.save_sublocality_cache()
+
+    def log_profile(self, *args):
+        # also used as a signal handler, which passes the signal number and frame
+        if self.handler.profiler is None:
+            log.info('Rule profiling is not enabled')
+            return
+        self.handler.profiler.log_report()
+
+    def config_reloaded(self, config, seconds):
+        with self.pending_lock:
+            self.pending_config = (config, seconds)
+
+    def apply_pending_config(self):
+        with self.pending_lock:
+            pending, self.pending_config = self.pending_config, None
+
+        if pending is not None:
+            self.apply_config(*pending)
+
+    def apply_config(self, config, seconds=0.0):
+        """
+        Swaps in a reloaded config, keeping the dedup stores, the gym state and the notification handlers.
+        Must be called from the notifier thread between batches.
+        """
+        if isinstance(self.queue, IngestQueue):
+            try:
+                self.queue.configure(config.queue_size, config.queue_policy)
+            except RuntimeError as e:
+                log.error('Could not apply the reloaded config, keeping the current one: %s', e)
+                return False
+
+        # handlers keep their sessions and pending deliveries, and replaced handlers stay replaced
+        config.notification_handlers.update(self.config.notification_handlers)
+        config.build_dispatch_tables()
+
+        self.notifier.set_config(config)
+        self.handler.set_config(config)
+        self.expiry_filter.min_pokemon_time_left = config.min_pokemon_time_left
+        self.expiry_filter.min_raid_time_left = config.min_raid_time_left
+        metrics.enabled = config.metrics
+
+        log.info('Reloaded the config in %.3fs: %s', seconds, format_changes(self.config, config))
+        restart = restart_settings(self.config, config)
+        if restart:
+            log.warning('Changes of %s only take effect after a restart', ', '.join(restart))
+        self.config = config
+        return True
 
     def run(self):
         log.info('Notifier thread started.')
+        self.reloader.start()
 
+        last_stats = time.time()
         while True:
-            for i in range(0, 5000):
-                data = self.queue.get(block=True)
-
-                message_type = data.get('type')
-
-                if message_type == 'pokemon':
-                    self.handler.handle_pokemon(data['message'])
-                elif message_type == 'gym_details':
-                    self.handler.handle_gym_details(data['message'])
-                elif message_type == 'raid':
-                    self.handler.handle_raid(data['message'])
-                else:
-                    log.debug('Unsupported message type: %s', message_type)
+            # wait for a frame, then take whatever else is already queued as one batch.
+            # the timeout makes sure expired entries are cleaned even when nothing arrives
+            try:
+                batch = [self.queue.get(block=True, timeout=1)]
+            except Queue.Empty:
+                batch = []
+
+            while batch and len(batch) < self.config.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            if batch:
+                self.process(batch)
+
+            # expired entries are popped off the dedup heaps, so this is cheap when nothing expired
             self.handler.clean()
+            self.apply_pending_config()
+
+            if time.time() - last_stats > self.config.stats_interval:
+                log.info('Dedup store sizes: %s', self.handler.dedup_stats())
+                if self.handler.cp_table is not None:
+                    log.info('Cp table: %s', self.handler.cp_table_stats())
+                if isinstance(self.queue, IngestQueue):
+                    log.info('Ingest: %s', self.ingest_stats())
+                if metrics.enabled:
+                    metrics.log_summary()
+                last_stats = time.time()
+
+    def process(self, batch):
+        self.handler.prime_geofences(batch)
+
+        now = time.time() if metrics.enabled else None
+        for data in batch:
+            message_type = data.get('type')
+            if now is not None and 'received' in data:
+                metrics.observe('queue_wait', message_type, now - data['received'])
+
+            self.dispatch(data)
+
+    def dispatch(self, data):
+        message_type = data.get('type')
+
+        if message_type == 'pokemon':
+            self.handler.handle_pokemon(data['message'])
+        elif message_type == 'gym_details':
+            self.handler.handle_gym_details(data['message'])
+        elif message_type == 'raid':
+            self.handler.handle_raid(data['message'])
+        else:
+            log.debug('Unsupported message type: %s', message_type)
 
     def enqueue(self, data):
-        self.queue.put(data)
+        if data.get('type') not in MESSAGE_TYPES:
+            log.debug('Unsupported message type: %s', data.get('type'))
+            return
+
+        timed = metrics.enabled
+        if timed:
+            start = time.time()
+            # for measuring how long frames wait in the queue
+            data['received'] = start
+
+        # expired frames are dropped here, so they never take up room in the queue
+        accepted = self.expiry_filter.accept(data)
+        if accepted:
+            try:
+                self.queue.put(data)
+            except QueueFull:
+                metrics.count('rejected', data.get('type'))
+                raise
+
+        if timed:
+            metrics.count('frames' if accepted else 'expired', data.get('type'))
+            metrics.observe('ingest', data.get('type'), time.time() - start)
 
@@ -0,0 +1,124 @@
+from bisect import bisect_left
+from threading import Lock
+import logging
+
+log = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets in seconds, from 10us doubling up to about 80s
+BUCKET_BOUNDS = [0.00001 * 2 ** i for i in range(24)]
+
+
+class Histogram:
+    """
+    Latency histogram with fixed, exponentially growing buckets, so observing a value is cheap
+    and memory use never grows. Percentiles are the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percentile):
+        if not self.count:
+            return None
+
+        rank = self.count * percentile / 100.0
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else None,
+            'p50_ms': round(self.percentile(50) * 1000, 3) if self.count else None,
+            'p99_ms': round(self.percentile(99) * 1000, 3) if self.count else None,
+            'max_ms': round(self.max * 1000, 3)
+        }
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the pipeline stages, labelled by message type or endpoint.
+    Disabled by default, callers check enabled before taking any timestamps, so it costs nothing then.
+
+    Components that keep statistics of their own, like queue and store sizes, register a function returning them,
+    which is only called for a snapshot.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.providers = {}
+
+    @staticmethod
+    def name(name, label):
+        return name if label is None else '%s.%s' % (name, label)
+
+    def count(self, name, label=None, n=1):
+        if not self.enabled:
+            return
+
+        key = self.name(name, label)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def observe(self, stage, label, seconds):
+        if not self.enabled:
+            return
+
+        key = self.name(stage, label)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[key] = histogram
+            histogram.observe(seconds)
+
+    def register(self, name, provider):
+        # replaces the provider of the same name, e.g. the one of a manager built before a restart
+        with self.lock:
+            self.providers[name] = provider
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = {
+                'counters': dict(self.counters),
+                'stages': {key: histogram.summary() for key, histogram in self.histograms.items()}
+            }
+            providers = dict(self.providers)
+
+        # providers take locks of their own, so they're called outside of ours
+        snapshot['stats'] = {name: provider() for name, provider in providers.items()}
+        return snapshot
+
+    def log_summary(self):
+        snapshot = self.snapshot()
+        for key in sorted(snapshot['stages']):
+            stage = snapshot['stages'][key]
+            log.info('%s: %d in %.3fms mean, %.3fms p50, %.3fms p99, %.3fms max', key, stage['count'],
+                     stage['mean_ms'], stage['p50_ms'], stage['p99_ms'], stage['max_ms'])
+        for key in sorted(snapshot['counters']):
+            log.info('%s: %d', key, snapshot['counters'][key])
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+
+metrics = Metrics()
@@ -19,3 +19,13 @@ class NotificationHandler(object):
 
     def notify_egg(self, endpoint, egg):
         raise NotImplementedError("abstract method")
+
+    def render(self, kind, data):
+        """
+        Returns the payload of a pokemon, gym, raid or egg notification. It's built once per message
+        and passed to deliver for every endpoint of this handler.
+        """
+        return data
+
+    def deliver(self, endpoint, kind, payload):
+        getattr(self, 'notify_' + kind)(endpoint, payload)
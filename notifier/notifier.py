@@ -1,18 +1,74 @@
 from .utils import *
+from .metrics import metrics
+from .sublocality import SublocalityCache
+import atexit
 import logging
+import time
 
 log = logging.getLogger(__name__)
 
 
 class Notifier:
-    def __init__(self, config):
+    def __init__(self, config, game_data=None):
         self.config = config
+        self.game_data = game_data if game_data is not None else get_game_data()
+
+        self.sublocality_cache = self.create_sublocality_cache(config)
+        # the cache is only saved every so often while sublocalities are fetched, this keeps the rest
+        atexit.register(self.save_sublocality_cache)
+
+    @staticmethod
+    def sublocality_settings(config):
+        return (config.fetch_sublocality, config.google_key, config.sublocality_precision,
+                config.sublocality_cache_size, config.sublocality_cache_file)
+
+    @staticmethod
+    def create_sublocality_cache(config):
+        if config.fetch_sublocality and config.google_key:
+            return SublocalityCache(
+                lambda lat, lon: fetch_sublocality(lat, lon, config.google_key),
+                config.sublocality_precision, config.sublocality_cache_size, config.sublocality_cache_file)
+        return None
+
+    def set_config(self, config):
+        # fetched sublocalities are kept unless the way they're fetched or cached changed
+        if self.sublocality_settings(config) != self.sublocality_settings(self.config):
+            self.save_sublocality_cache()
+            self.sublocality_cache = self.create_sublocality_cache(config)
+        self.config = config
+
+    def save_sublocality_cache(self):
+        if self.sublocality_cache is not None and self.sublocality_cache.cache_file is not None:
+            self.sublocality_cache.save()
+
+    def wants_sublocality(self):
+        return self.config.fetch_sublocality or self.config.sublocality_index is not None
+
+    def get_sublocality(self, lat, lon):
+        # areas from the local sublocality file don't need any network requests
+        if self.config.sublocality_index is not None:
+            sublocality = self.config.sublocality_index.smallest_at(lat, lon)
+            if sublocality is not None or not self.config.fetch_sublocality:
+                return sublocality
+
+        if self.sublocality_cache is None:
+            log.warn('You must provide a google api key in order to fetch sublocality')
+            return None
+
+        return self.sublocality_cache.get(lat, lon)
 
     def set_notification_handler(self, name, handler):
         self.config.notification_handlers[name] = handler
+        self.config.build_dispatch_tables()
+
+    def notify_pokemon(self, pokemon, message, targets):
+        """
+        Enriches the pokemon once and notifies it to all given (handler, endpoint ref, endpoint) targets
+        """
+        timed = metrics.enabled
+        if timed:
+            start = time.time()
 
-    def notify_pokemon(self, pokemon, message, notification_setting):
-        # find the handler and notify
         lat = message['latitude']
         lon = message['longitude']
         data = {
@@ -26,34 +82,25 @@ class Notifier:
         pokemon.update(data)
 
         # add sublocality
-        if self.config.fetch_sublocality and 'sublocality' not in pokemon:
-            if not self.config.google_key:
-                log.warn('You must provide a google api key in order to fetch sublocality')
-                pokemon['sublocality'] = None
-            else:
-                pokemon['sublocality'] = get_sublocality(pokemon['lat'], pokemon['lon'], self.config.google_key)
-
-        # now notify all endpoints
-        endpoints = notification_setting.get('endpoints', ['simple'])
-        for endpoint_ref in endpoints:
-            endpoint = self.config.endpoints.get(endpoint_ref, {})
-            notification_type = endpoint.get('type', 'simple')
-            notification_handler = self.config.notification_handlers[notification_type]
-
-            log.debug(u"Notifying to endpoint {} about {}".format(endpoint_ref, pokemon['name']))
-            notification_handler.notify_pokemon(endpoint, pokemon)
-
-    def notify_gym(self, data, notification_setting):
-        endpoints = notification_setting.get('endpoints', ['simple'])
-        for endpoint_ref in endpoints:
-            endpoint = self.config.endpoints.get(endpoint_ref, {})
-            notification_type = endpoint.get('type', 'simple')
-            notification_handler = self.config.notification_handlers[notification_type]
-
-            notification_handler.notify_gym(endpoint, data)
-
-    def notify_raid_or_egg(self, raid_in, notification_setting):
-        # find the handler and notify
+        if self.wants_sublocality() and 'sublocality' not in pokemon:
+            pokemon['sublocality'] = self.get_sublocality(pokemon['lat'], pokemon['lon'])
+
+        if timed:
+            metrics.observe('enrich', 'pokemon', time.time() - start)
+
+        self.fan_out('pokemon', pokemon, targets)
+
+    def notify_gym(self, data, targets):
+        self.fan_out('gym', data, targets)
+
+    def notify_raid_or_egg(self, raid_in, targets):
+        """
+        Enriches the raid or egg once and notifies it to all given (handler, endpoint ref, endpoint) targets
+        """
+        timed = metrics.enabled
+        if timed:
+            start = time.time()
+
         lat = raid_in['lat']
         lon = raid_in['lon']
 
@@ -77,24 +124,29 @@ class Notifier:
             raid['gym'] = {'name': '(Unknown)'}
 
         # add sublocality
-        if self.config.fetch_sublocality and 'sublocality' not in raid:
-            if not self.config.google_key:
-                log.warn('You must provide a google api key in order to fetch sublocality')
-                raid['sublocality'] = None
-            else:
-                raid['sublocality'] = get_sublocality(raid['lat'], raid['lon'], self.config.google_key)
-
-        # now notify all endpoints
-        endpoints = notification_setting.get('endpoints', ['simple'])
-        for endpoint_ref in endpoints:
-            endpoint = self.config.endpoints.get(endpoint_ref, {})
-            notification_type = endpoint.get('type', 'simple')
-            notification_handler = self.config.notification_handlers[notification_type]
-
-            log.debug(
-                u"Notifying to endpoint {} about {} on {}".format(endpoint_ref, "egg" if raid["egg"] else "raid",
-                                                                  raid['name']))
-            if raid['egg']:
-                notification_handler.notify_egg(endpoint, raid)
-            else:
-                notification_handler.notify_raid(endpoint, raid)
+        if self.wants_sublocality() and 'sublocality' not in raid:
+            raid['sublocality'] = self.get_sublocality(raid['lat'], raid['lon'])
+
+        if timed:
+            metrics.observe('enrich', 'egg' if raid['egg'] else 'raid', time.time() - start)
+
+        self.fan_out('egg' if raid['egg'] else 'raid', raid, targets)
+
+    def fan_out(self, kind, data, targets):
+        """
+        Sends data to the targets from the dispatch tables. The payload is rendered only once per handler
+        and shared by all of its endpoints.
+        """
+        timed = metrics.enabled
+        payloads = {}
+
+        for notification_handler, endpoint_ref, endpoint in targets:
+            if notification_handler not in payloads:
+                payloads[notification_handler] = notification_handler.render(kind, data)
+
+            log.debug(u"Notifying to endpoint {} about {} {}".format(endpoint_ref, kind, data.get('name')))
+            if timed:
+                start = time.time()
+            notification_handler.deliver(endpoint, kind, payloads[notification_handler])
+            if timed:
+                metrics.observe('deliver', endpoint_ref, time.time() - start)
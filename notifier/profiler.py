@@ -0,0 +1,75 @@
+from threading import Lock
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class RuleStats:
+    def __init__(self):
+        self.evaluations = 0
+        self.matches = 0
+        self.time = 0.0
+        self.failures = {}
+
+
+class RuleProfiler:
+    """
+    Records how often every rule of the includes is evaluated and matches, how long it takes,
+    and which predicate fails first when it doesn't match
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.rules = {}
+
+    def record(self, kind, include_ref, index, seconds, failed):
+        key = (kind, include_ref, index)
+        with self.lock:
+            stats = self.rules.get(key)
+            if stats is None:
+                stats = RuleStats()
+                self.rules[key] = stats
+
+            stats.evaluations += 1
+            stats.time += seconds
+            if failed is None:
+                stats.matches += 1
+            else:
+                stats.failures[failed] = stats.failures.get(failed, 0) + 1
+
+    def report(self):
+        """
+        Returns a row for every rule, the most expensive first
+        """
+        with self.lock:
+            rows = [{
+                'kind': kind,
+                'include': include_ref,
+                'rule': index,
+                'evaluations': stats.evaluations,
+                'matches': stats.matches,
+                'total_ms': stats.time * 1000,
+                'mean_us': stats.time / stats.evaluations * 1000000,
+                'failures': sorted(stats.failures.items(), key=lambda failure: -failure[1])
+            } for (kind, include_ref, index), stats in self.rules.items()]
+
+        rows.sort(key=lambda row: -row['total_ms'])
+        return rows
+
+    def format_report(self):
+        lines = ['%-8s %-30s %5s %12s %10s %12s %10s  %s' % (
+            'kind', 'include', 'rule', 'evaluations', 'matches', 'total_ms', 'mean_us', 'first failing predicates')]
+        for row in self.report():
+            failures = ', '.join('%s %d' % failure for failure in row['failures'])
+            lines.append('%-8s %-30s %5d %12d %10d %12.3f %10.2f  %s' % (
+                row['kind'], row['include'], row['rule'], row['evaluations'], row['matches'], row['total_ms'],
+                row['mean_us'], failures))
+        return '\n'.join(lines)
+
+    def log_report(self, *args):
+        # also used as a signal handler, which passes the signal number and frame
+        log.info('Rule profile:\n%s', self.format_report())
+
+    def reset(self):
+        with self.lock:
+            self.rules = {}
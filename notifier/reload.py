@@ -0,0 +1,114 @@
+from threading import Event, Thread
+from .config import Config
+import copy
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+# settings only read at startup, a reload can't apply them
+RESTART_SETTINGS = ('dedup_capacity', 'delivery_workers', 'coalesce_notifications', 'body_queue_size', 'processes')
+
+
+def watched_files(config_file, config):
+    """
+    Returns the files a config is read from, the config file itself unless it's a dict
+    """
+    files = [config_file] if isinstance(config_file, str) else []
+    files.extend(filename for filename in (config.geofence_file, config.sublocality_file) if filename)
+    return files
+
+
+def modification_times(files):
+    times = {}
+    for filename in files:
+        try:
+            times[filename] = os.path.getmtime(filename)
+        except OSError:
+            # being replaced right now, it's picked up by the next check
+            times[filename] = None
+    return times
+
+
+class ConfigReloader(Thread):
+    """
+    Builds a new Config when the config or geofence files change or a reload is requested, and passes it
+    to on_reload along with the seconds it took. Parsing and compiling happen on this thread,
+    so matching goes on with the current config meanwhile. With an interval of 0 files aren't watched,
+    the config is only reloaded on request.
+
+    A config dict must be passed untouched, Config resolves it in place.
+    """
+
+    def __init__(self, config_file, config, on_reload, interval=10):
+        super(ConfigReloader, self).__init__()
+
+        self.daemon = True
+        self.name = 'ConfigReloader'
+
+        self.config_file = config_file
+        self.on_reload = on_reload
+        self.interval = interval
+        self.requested = Event()
+        self.files = watched_files(config_file, config)
+        self.times = modification_times(self.files)
+
+    def request(self, *args):
+        # also used as a signal handler, which passes the signal number and frame
+        self.requested.set()
+
+    def changed(self):
+        times = modification_times(self.files)
+        if times == self.times:
+            return False
+
+        self.times = times
+        return True
+
+    def run(self):
+        while True:
+            requested = self.requested.wait(self.interval if self.interval > 0 else None)
+            self.requested.clear()
+
+            if requested or self.changed():
+                self.reload()
+
+    def reload(self):
+        start = time.time()
+        try:
+            # every reload needs an untouched copy of a config dict
+            config = Config(copy.deepcopy(self.config_file))
+        except Exception:
+            log.exception('Could not reload the config, keeping the current one')
+            return False
+
+        self.files = watched_files(self.config_file, config)
+        self.times = modification_times(self.files)
+        self.on_reload(config, time.time() - start)
+        return True
+
+
+def rule_counts(config):
+    return {
+        'pokemon rules': config.pokemon_index.rule_count,
+        'raid includes': len(config.raid_includes),
+        'geofences': len(config.geofences),
+        'notification settings': len(config.notification_settings)
+    }
+
+
+def format_changes(old, new):
+    """
+    Describes how the rules changed from the old to the new config, for the log
+    """
+    old_counts = rule_counts(old)
+    new_counts = rule_counts(new)
+    return ', '.join('%s %d -> %d' % (name, old_counts[name], new_counts[name]) for name in sorted(new_counts))
+
+
+def restart_settings(old, new, names=RESTART_SETTINGS):
+    """
+    Returns the settings that changed from the old to the new config, but only take effect after a restart
+    """
+    return [name for name in names if getattr(old, name) != getattr(new, name)]
@@ -0,0 +1,145 @@
+from .utils import *
+import logging
+
+log = logging.getLogger(__name__)
+
+# numeric keys with min_ and max_ thresholds, in the order they're checked
+THRESHOLD_KEYS = ('lat', 'lon', 'id', 'iv', 'attack', 'defense', 'stamina', 'level')
+
+# keys checked by Handler.extra_checks, in the order it evaluates them
+EXTRA_KEYS = ('min_cp', 'max_cp', 'min_hp', 'max_hp', 'moves', 'geofence')
+
+# the widest id range that is expanded into per-species buckets instead of the wildcard bucket
+MAX_BUCKET_RANGE = 1000
+
+
+class PokemonRule:
+    def __init__(self, include_ref, index, rules, skip_id=False):
+        self.include_ref = include_ref
+        self.index = index
+        self.rules = rules
+        self.name = rules.get('name')
+
+        # flat threshold arrays. missing pokemon values count as -1 for minimums and 99999 for maximums
+        self.keys = []
+        self.minimums = []
+        self.maximums = []
+        for key in THRESHOLD_KEYS:
+            if skip_id and key == 'id':
+                continue
+
+            min_value = rules.get('min_' + key)
+            max_value = rules.get('max_' + key)
+            if min_value is None and max_value is None:
+                continue
+
+            self.keys.append(key)
+            self.minimums.append(min_value)
+            self.maximums.append(max_value)
+
+        # true if anything beyond the name and thresholds has to be checked by the handler
+        self.has_extra = any(key in rules for key in EXTRA_KEYS)
+
+    def matches_thresholds(self, pokemon):
+        """
+        Returns the first failing key, or None if the name and all numeric thresholds match
+        """
+        if self.name is not None and self.name != pokemon['name']:
+            return 'name'
+
+        for i in range(len(self.keys)):
+            key = self.keys[i]
+            min_value = self.minimums[i]
+            if min_value is not None and pokemon.get(key, -1) < min_value:
+                return 'min_' + key
+
+            max_value = self.maximums[i]
+            if max_value is not None and pokemon.get(key, 99999) > max_value:
+                return 'max_' + key
+
+        return None
+
+    def failed_extra(self, match_data):
+        """
+        Returns the key extra_checks failed on, the first one it didn't add to match_data
+        """
+        for key in EXTRA_KEYS:
+            if key in self.rules and key not in match_data:
+                return key
+        return None
+
+    def match_data(self):
+        match_data = []
+        if self.name is not None:
+            match_data.append('name')
+        for i in range(len(self.keys)):
+            if self.minimums[i] is not None:
+                match_data.append('min_' + self.keys[i])
+            if self.maximums[i] is not None:
+                match_data.append('max_' + self.keys[i])
+        return match_data
+
+
+class PokemonRuleIndex:
+    def __init__(self, pokemon_includes):
+        self.species = {}
+        self.wildcard = []
+        self.rule_count = 0
+
+        for include_ref in sorted(pokemon_includes):
+            for index, rules in enumerate(pokemon_includes[include_ref]):
+                self.add(include_ref, index, rules)
+
+        log.info('Compiled %d pokemon rules into %d species buckets and %d wildcard rules',
+                 self.rule_count, len(self.species), len(self.wildcard))
+
+    def add(self, include_ref, index, rules):
+        self.rule_count += 1
+
+        pokemon_ids = self.get_pokemon_ids(rules)
+        if pokemon_ids is None:
+            self.wildcard.append(PokemonRule(include_ref, index, rules))
+            return
+
+        # the bucket guarantees the id range, so there's no need to check it again
+        rule = PokemonRule(include_ref, index, rules, skip_id=True)
+        for pokemon_id in pokemon_ids:
+            if pokemon_id not in self.species:
+                self.species[pokemon_id] = []
+            self.species[pokemon_id].append(rule)
+
+    @staticmethod
+    def get_pokemon_ids(rules):
+        """
+        Returns the pokemon ids the given rule can match, or None if it belongs in the wildcard bucket
+        """
+        min_id = rules.get('min_id')
+        max_id = rules.get('max_id')
+
+        name = rules.get('name')
+        if name is not None:
+            pokemon_id = int(get_pokemon_id(name))
+            if pokemon_id < 0:
+                log.warning(u'Unknown pokemon name in rule: %s', name)
+                return None
+
+            if min_id is not None and pokemon_id < min_id or max_id is not None and pokemon_id > max_id:
+                return []
+
+            return [pokemon_id]
+
+        if min_id is None or max_id is None or max_id - min_id > MAX_BUCKET_RANGE:
+            return None
+
+        return range(int(math.ceil(min_id)), int(math.floor(max_id)) + 1)
+
+    def candidates(self, pokemon_id):
+        """
+        Returns all rules that could match a pokemon with the given id
+        """
+        bucket = self.species.get(pokemon_id)
+        if bucket is None:
+            return self.wildcard
+        if not self.wildcard:
+            return bucket
+        return bucket + self.wildcard
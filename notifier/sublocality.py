@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from threading import Event, Lock
+import json
+import logging
+import os
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+
+class SublocalityCache:
+    """
+    Caches sublocality lookups per coordinate cell, rounded to the given number of decimals.
+    The least recently used cells are evicted first, and the cache is saved to disk so it survives restarts.
+    Concurrent lookups of the same cell wait for the first one instead of asking again.
+    """
+
+    def __init__(self, lookup, precision=3, max_size=10000, cache_file=None, save_interval=60):
+        self.lookup = lookup
+        self.precision = precision
+        self.max_size = max_size
+        self.cache_file = cache_file
+        self.save_interval = save_interval
+
+        self.lock = Lock()
+        self.cells = OrderedDict()
+        self.in_flight = {}
+        self.dirty = False
+        self.last_save = time.time()
+
+        if cache_file is not None and os.path.exists(cache_file):
+            self.load()
+
+    def key(self, latitude, longitude):
+        return '%.*f,%.*f' % (self.precision, latitude, self.precision, longitude)
+
+    def get(self, latitude, longitude):
+        key = self.key(latitude, longitude)
+
+        with self.lock:
+            if key in self.cells:
+                value = self.cells.pop(key)
+                self.cells[key] = value
+                return value
+
+            event = self.in_flight.get(key)
+            if event is None:
+                self.in_flight[key] = Event()
+
+        if event is not None:
+            # someone else is looking up this cell already
+            event.wait(30)
+            with self.lock:
+                return self.cells.get(key)
+
+        try:
+            value = self.lookup(latitude, longitude)
+        except Exception:
+            log.exception('Error fetching sublocality')
+            with self.lock:
+                self.in_flight.pop(key).set()
+            return None
+
+        with self.lock:
+            self.put(key, value)
+            self.in_flight.pop(key).set()
+
+        if self.cache_file is not None and time.time() - self.last_save > self.save_interval:
+            self.save()
+
+        return value
+
+    def put(self, key, value):
+        self.cells[key] = value
+        self.dirty = True
+        while len(self.cells) > self.max_size:
+            self.cells.popitem(last=False)
+
+    def load(self):
+        try:
+            with open(self.cache_file) as f:
+                cells = json.load(f)
+        except (IOError, ValueError):
+            log.exception('Could not load sublocality cache %s', self.cache_file)
+            return
+
+        with self.lock:
+            for key, value in cells:
+                self.put(key, value)
+            self.dirty = False
+
+        log.info('Loaded %d sublocalities from %s', len(self.cells), self.cache_file)
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            cells = list(self.cells.items())
+            self.dirty = False
+            self.last_save = time.time()
+
+        # other processes may share the cache file, keep what they saved meanwhile.
+        # their cells count as older, and the most recent max_size cells are kept
+        merged = OrderedDict()
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file) as f:
+                    merged.update((key, value) for key, value in json.load(f))
+            except (IOError, ValueError):
+                log.warning('Could not read sublocality cache %s, overwriting it', self.cache_file)
+
+        for key, value in cells:
+            merged.pop(key, None)
+            merged[key] = value
+        while len(merged) > self.max_size:
+            merged.popitem(last=False)
+
+        # write to a temporary file of our own first, so neither a crash nor another process saving
+        # at the same time ever leaves a broken cache behind
+        directory, name = os.path.split(os.path.abspath(self.cache_file))
+        try:
+            descriptor, temporary_file = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory)
+        except (IOError, OSError):
+            log.exception('Could not save sublocality cache %s', self.cache_file)
+            return
+
+        try:
+            with os.fdopen(descriptor, 'w') as f:
+                json.dump(list(merged.items()), f)
+            os.rename(temporary_file, self.cache_file)
+        except (IOError, OSError):
+            log.exception('Could not save sublocality cache %s', self.cache_file)
+            if os.path.exists(temporary_file):
+                os.remove(temporary_file)
@@ -1,39 +1,23 @@
-import json
 import datetime
 import requests
 import logging
 import gpxpy.geo
 import math
+from .gamedata import get_game_data
 
 log = logging.getLogger(__name__)
 
 
 def get_pokemon_name(pokemon_id):
-    if not hasattr(get_pokemon_name, 'names'):
-        with open('data/names.json', 'r') as f:
-            get_pokemon_name.names = json.load(f)
-
-    return get_pokemon_name.names.get(str(pokemon_id), 'unknown')
+    return get_game_data().pokemon_name(pokemon_id)
 
 
 def get_pokemon_id(pokemon_name):
-    if not hasattr(get_pokemon_id, 'ids'):
-        if not hasattr(get_pokemon_name, 'names'):
-            get_pokemon_name(1) # initialize it
-
-        get_pokemon_id.ids = {}
-        for id, name in get_pokemon_name.names.iteritems():
-            get_pokemon_id.ids[name] = str(id)
-
-    return get_pokemon_id.ids.get(pokemon_name, '-1')
+    return str(get_game_data().pokemon_id(pokemon_name))
 
 
 def get_move_name(move_id):
-    if not hasattr(get_move_name, 'names'):
-        with open('data/moves.json', 'r') as f:
-            get_move_name.names = json.load(f)
-
-    return get_move_name.names.get(str(move_id), 'unknown')
+    return get_game_data().move_name(move_id)
 
 
 def get_team_name(team_id):
@@ -83,6 +67,21 @@ def get_sublocality(latitude, longitude, api_key):
     if not api_key:
         return None
 
+    try:
+        return fetch_sublocality(latitude, longitude, api_key)
+    except requests.exceptions.RequestException as e:
+        log.exception("Error fetching sublocality")
+        return None
+    except ValueError as e:
+        log.error("Error in response when fetching sublocality: %s", e)
+        return None
+
+
+def fetch_sublocality(latitude, longitude, api_key, timeout=5):
+    """
+    Returns the sublocality of the given coordinates, or None if there isn't one.
+    Raises an exception if it couldn't be fetched.
+    """
     base = "https://maps.googleapis.com/maps/api/geocode/json?"
     params = "latlng={lat},{lon}&sensor={sen}&key={api_key}".format(
         lat=latitude,
@@ -91,15 +90,10 @@ def get_sublocality(latitude, longitude, api_key):
         api_key=api_key
     )
     url = "{base}{params}".format(base=base, params=params)
-    try:
-        response = requests.get(url)
-    except requests.exceptions.RequestException as e:
-        log.exception("Error fetching sublocality")
-        return None
+    response = requests.get(url, timeout=timeout)
 
     if not response.ok:
-        log.error("Error in response when fetching sublocality: %s", str(response))
-        return None
+        raise ValueError(str(response))
 
     for result in response.json()['results']:
         if 'address_components' in result:
@@ -119,38 +113,16 @@ def get_distance(lat1, lon1, lat2, lon2):
 
 
 def get_stats(pokemon_id):
-    if not hasattr(get_pokemon_name, 'stats'):
-        with open('data/stats.json', 'r') as f:
-            get_stats.stats = json.load(f)
-
-    return get_stats.stats.get(str(pokemon_id))
+    return get_game_data().stats(pokemon_id)
 
 
 def get_cpm_for_level(level):
-    if not hasattr(get_cpm_for_level, 'cpm'):
-        with open('data/cpm.json', 'r') as f:
-            get_cpm_for_level.cpm = json.load(f)
-
-    return get_cpm_for_level.cpm.get(str(level))
+    return get_game_data().cpm_for_level(level)
 
 
 def get_level_from_cpm(cpm_in):
-    if not hasattr(get_level_from_cpm, 'levels'):
-        if not hasattr(get_cpm_for_level, 'cpm'):
-            get_cpm_for_level(1)
-
-    cpm_in = str(cpm_in)
-    max_length = 5
-
-    if len(cpm_in) > max_length:
-        cpm_in = cpm_in[:max_length]
-
-    level_to_cpm = {}
-    for level,cpm in get_cpm_for_level.cpm.iteritems():
-        cpm_cmp = str(cpm)[:max_length]
-        level_to_cpm[cpm_cmp] = level
-
-    return int(level_to_cpm.get(cpm_in, '-1'))
+    level = get_game_data().level_for_cpm(cpm_in)
+    return level if level is not None else -1
 
 
 def get_cp_for_level(pokemon_id, level, iv_attack, iv_defense, iv_stamina):
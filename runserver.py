@@ -1,11 +1,17 @@
 # For running standalone using Flask and Gevent
 
 import configargparse
+import json
 import logging
+import signal
+import sys
 
 from flask import Flask, request
 from gevent import wsgi
 
+from fastserver import FastReceiver
+from notifier.ingest import QueueFull
+from notifier.metrics import metrics
 from server import Receiver
 
 
@@ -14,7 +20,23 @@ app = Flask(__name__)
 
 @app.route('/', methods=['POST'])
 def webhook_receiver():
-    receiver.process(request.data)
+    try:
+        return receiver.process_stream(request.stream)
+    except QueueFull:
+        return '', 503
+
+
+@app.route('/profile', methods=['GET'])
+def profile_endpoint():
+    report = receiver.profile_report()
+    if report is None:
+        return 'Rule profiling is not enabled\n', 404, {'Content-Type': 'text/plain'}
+    return report + '\n', 200, {'Content-Type': 'text/plain'}
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return json.dumps(metrics.snapshot()), 200, {'Content-Type': 'application/json'}
 
 
 if __name__ == '__main__':
@@ -22,14 +44,28 @@ if __name__ == '__main__':
     parser.add_argument('--host', help='Host', default='localhost')
     parser.add_argument('-p', '--port', help='Port', type=int, default=8000)
     parser.add_argument('-c', '--config', help="config.json file to use", default="config/config.json")
+    parser.add_argument('--fast', help='Use the lightweight receiver, which acknowledges requests before parsing them',
+                        action='store_true')
+    parser.add_argument('--processes', help='Number of processes matching notifications, overrides the config',
+                        type=int)
     args = parser.parse_args()
  
-    receiver = Receiver(args.config)
+    receiver = Receiver(args.config, args.processes)
+
+    # exit normally on SIGTERM too, so the atexit handlers save the sublocality cache
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # SIGHUP reloads the config, SIGUSR1 logs the rule profile
+    signal.signal(signal.SIGHUP, receiver.notifiermanager.reloader.request)
+    signal.signal(signal.SIGUSR1, receiver.notifiermanager.log_profile)
 
     # Removes logging of each received request to flask server
     logging.getLogger('pywsgi').setLevel(logging.WARNING)
 
     logging.getLogger().info("Webhook server started on http://{}:{}".format(args.host, args.port))
 
-    server = wsgi.WSGIServer((args.host, args.port), app, log=logging.getLogger('pywsgi'))
+    if args.fast:
+        config = receiver.notifiermanager.config
+        server = FastReceiver(receiver, args.host, args.port, config.stats_interval, queue_size=config.body_queue_size)
+    else:
+        server = wsgi.WSGIServer((args.host, args.port), app, log=logging.getLogger('pywsgi'))
     server.serve_forever()
@@ -1,13 +1,20 @@
+import commentjson
 import logging
 import logging.config
-import json
 import yaml
 
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from notifier.cluster import ShardedNotifierManager
+from notifier.ingest import iter_frames
 from notifier.manager import NotifierManager
 
 
 class Receiver():
-    def __init__(self, config):
+    def __init__(self, config, processes=None):
         # Setup logging
         with open('logging.yaml') as f:
             logging.config.dictConfig(yaml.load(f))
@@ -17,11 +24,33 @@ class Receiver():
         # Remove logging of each sent request to discord
         logging.getLogger('requests').setLevel(logging.WARNING)
 
-        self.notifiermanager = NotifierManager(config)
+        if processes is None:
+            processes = self.configured_processes(config)
+
+        # with several processes, matching is spread over the cores and delivery stays in this process
+        if processes > 1:
+            self.notifiermanager = ShardedNotifierManager(config, processes)
+        else:
+            self.notifiermanager = NotifierManager(config)
         self.notifiermanager.start()
 
 
+    @staticmethod
+    def configured_processes(config):
+        # only the config section is needed here, the managers parse the whole config themselves
+        if isinstance(config, str):
+            with open(config) as f:
+                config = commentjson.load(f)
+        return config.get('config', {}).get('processes', 0)
+
+    def profile_report(self):
+        # only available with profile_rules, and not when matching runs in separate processes
+        profiler = getattr(getattr(self.notifiermanager, 'handler', None), 'profiler', None)
+        return profiler.format_report() if profiler is not None else None
+
     def process(self, request_body):
+        # raises QueueFull when the queue rejects a frame. the scanner sends the whole request again,
+        # frames that were already queued are caught by the dedup stores
         data = json.loads(request_body)
         if type(data) == dict:
             self.notifiermanager.enqueue(data)
@@ -30,3 +59,10 @@ class Receiver():
                 self.notifiermanager.enqueue(frame)
 
         return ""
+
+    def process_stream(self, stream, length=None):
+        # frames are queued while the rest of the body is still being read and decoded
+        for frame in iter_frames(stream, length):
+            self.notifiermanager.enqueue(frame)
+
+        return ""
@@ -59,6 +59,10 @@ class TestNotifier(unittest.TestCase):
         self.notifier = self.notifiermanager.notifier
         self.notifierhandler = self.notifiermanager.handler
 
+    def tearDown(self):
+        # notifications are delivered by the worker pool, wait for them to be sent
+        self.config.notification_handlers['discord'].pool.wait(60)
+
     def test_pokemon_without_encounter(self):
         data = self._get_data("pokemon-without-encounter")
         self.notifierhandler.handle_pokemon(data['message'])
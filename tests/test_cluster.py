@@ -0,0 +1,86 @@
+from notifier import NotificationHandler
+from notifier.cluster import ShardedNotifierManager
+from notifier.config import Config
+import copy
+import json
+import Queue
+import time
+import unittest
+
+
+class RecordingHandler(NotificationHandler):
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.received = Queue.Queue()
+
+    def notify_pokemon(self, endpoint, pokemon):
+        self.received.put(pokemon['encounter_id'])
+
+
+class TestCluster(unittest.TestCase):
+    @staticmethod
+    def _make_config():
+        return {
+            "config": {},
+            "includes": {
+                "default_pokemon": {
+                    "pokemons": [{"min_id": 0, "max_id": 999}]
+                }
+            },
+            "notification_settings": {
+                "Default": {
+                    "includes": ["default_pokemon"]
+                }
+            }
+        }
+
+    def setUp(self):
+        self.manager = ShardedNotifierManager(self._make_config(), 3)
+
+    def tearDown(self):
+        self.manager.stop()
+
+    def test_shards_are_stable(self):
+        for i in range(100):
+            pokemon = {'type': 'pokemon', 'message': {'encounter_id': 'encounter%d' % i}}
+            raid = {'type': 'raid', 'message': {'gym_id': 'gym%d' % i}}
+            gym = {'type': 'gym_details', 'message': {'id': 'gym%d' % i}}
+
+            self.assertEqual(self.manager.shard(pokemon), self.manager.shard(copy.deepcopy(pokemon)))
+            self.assertEqual(self.manager.shard(raid), self.manager.shard(gym))
+            self.assertTrue(0 <= self.manager.shard(pokemon) < 3)
+
+        shards = set(self.manager.shard({'type': 'pokemon', 'message': {'encounter_id': i}}) for i in range(100))
+        self.assertEqual(shards, set([0, 1, 2]))
+
+    def test_delivers_from_workers(self):
+        handler = RecordingHandler()
+        self.manager.config.notification_handlers['simple'] = handler
+        self.manager.start()
+
+        with open('tests/data/webhooks/pokemon-without-encounter.json') as f:
+            frame = json.load(f)
+
+        encounter_ids = set()
+        for i in range(20):
+            data = copy.deepcopy(frame)
+            data['message']['encounter_id'] = 'encounter%d' % i
+            data['message']['disappear_time'] = time.time() + 600
+            encounter_ids.add(data['message']['encounter_id'])
+
+            # duplicates land on the same shard, so they are only notified once
+            self.manager.enqueue(data)
+            self.manager.enqueue(data)
+
+        received = [handler.received.get(timeout=10) for _ in encounter_ids]
+        self.assertEqual(set(received), encounter_ids)
+        self.assertRaises(Queue.Empty, handler.received.get, timeout=0.5)
+
+    def test_reload_out_of_band(self):
+        # a frame claiming to be a reload is dropped at ingest
+        self.manager.enqueue({'type': 'reload'})
+        self.assertTrue(all(inbound.empty() for inbound in self.manager.inbound))
+        self.assertFalse(any(reload_event.is_set() for reload_event in self.manager.reload_events))
+
+        self.manager.config_reloaded(Config(self._make_config()), 0.0)
+        self.assertTrue(all(reload_event.is_set() for reload_event in self.manager.reload_events))
@@ -0,0 +1,116 @@
+from notifier.dedup import CompactDedupTable, ExpiringSet
+import unittest
+
+
+class TestDedup(unittest.TestCase):
+    def test_expire(self):
+        processed = ExpiringSet()
+        processed.add('a', 30)
+        processed.add('b', 10)
+        processed.add('c', 20)
+
+        self.assertTrue('b' in processed)
+        self.assertEqual(processed.expire(5), 0)
+        self.assertEqual(processed.expire(20), 2)
+        self.assertFalse('b' in processed)
+        self.assertFalse('c' in processed)
+        self.assertTrue('a' in processed)
+        self.assertEqual(processed.stats(), {'size': 1, 'peak': 3})
+
+    def test_added_again(self):
+        processed = ExpiringSet()
+        processed.add('a', 10)
+        processed.add('a', 30)
+
+        self.assertEqual(processed.expire(20), 0)
+        self.assertTrue('a' in processed)
+        self.assertEqual(processed.expire(30), 1)
+        self.assertEqual(len(processed), 0)
+
+
+class TestCompactDedup(unittest.TestCase):
+    def test_contains(self):
+        processed = CompactDedupTable(100)
+        for i in range(50):
+            processed.add('encounter%d' % i, 1000 + i)
+
+        self.assertEqual(len(processed), 50)
+        self.assertTrue('encounter0' in processed)
+        self.assertTrue('encounter49' in processed)
+        self.assertFalse('encounter50' in processed)
+
+    def test_oldest_evicted_first(self):
+        processed = CompactDedupTable(10)
+        for i in range(25):
+            processed.add('encounter%d' % i, 1000)
+
+        self.assertEqual(len(processed), 10)
+        self.assertEqual([i for i in range(25) if 'encounter%d' % i in processed], range(15, 25))
+        self.assertEqual(processed.stats()['evicted'], 15)
+
+    def test_expire(self):
+        processed = CompactDedupTable(1000)
+        for i in range(1000):
+            processed.add('encounter%d' % i, i)
+
+        removed = 0
+        for _ in range(10):
+            removed += processed.expire(499, slots=512)
+
+        self.assertEqual(removed, 500)
+        self.assertEqual(len(processed), 500)
+        self.assertEqual([i for i in range(1000) if 'encounter%d' % i in processed], range(500, 1000))
+
+    def test_collisions(self):
+        # small table with many deletes, all lookups must still find the remaining keys
+        processed = CompactDedupTable(64)
+        keys = range(0, 64 * 128, 128)
+        for key in keys:
+            processed.add(key, key)
+        processed.expire(64 * 64, slots=1024)
+
+        self.assertEqual([key for key in keys if key in processed], [key for key in keys if key > 64 * 64])
+
+    def test_only_live_keys_evicted(self):
+        processed = CompactDedupTable(4)
+        processed.add('a', 100)
+        for key in ('b', 'c', 'd'):
+            processed.add(key, 10)
+        processed.expire(50)
+
+        for key in ('e', 'f', 'g'):
+            processed.add(key, 100)
+        self.assertEqual(processed.stats()['evicted'], 0)
+        self.assertTrue('a' in processed)
+
+        processed.add('h', 100)
+        self.assertEqual(processed.stats()['evicted'], 1)
+        self.assertFalse('a' in processed)
+        self.assertEqual(len(processed), 4)
+
+    def test_added_again(self):
+        processed = CompactDedupTable(2)
+        for _ in range(10):
+            processed.add('a', 100)
+            processed.add('a', 200)
+        processed.add('b', 100)
+
+        self.assertEqual(processed.stats()['evicted'], 0)
+        self.assertTrue('a' in processed)
+        self.assertTrue('b' in processed)
+
+    def test_zero_key(self):
+        processed = CompactDedupTable(10)
+        processed.add(0, 100)
+        self.assertTrue(0 in processed)
+        self.assertFalse(1 in processed)
+
+    def test_ring_compaction_keeps_order(self):
+        processed = CompactDedupTable(4)
+        for i in range(50):
+            # every other key expires right away, so the ring fills up with stale entries
+            processed.add('stale%d' % i, 1)
+            processed.expire(1)
+            processed.add('live%d' % i, 1000 + i)
+
+        self.assertEqual([i for i in range(50) if 'live%d' % i in processed], range(46, 50))
@@ -0,0 +1,176 @@
+from notifier.delivery import DeliveryPool, RateLimited, TokenBucket
+from notifier.discord import Discord
+from threading import Lock
+import unittest
+
+
+class FakeResponse:
+    def __init__(self, url, headers=None, body=None):
+        self.url = url
+        self.headers = headers or {}
+        self.body = body
+
+    def json(self):
+        if self.body is None:
+            raise ValueError('No JSON object could be decoded')
+        return self.body
+
+
+class TestDelivery(unittest.TestCase):
+    def setUp(self):
+        self.lock = Lock()
+        self.attempts = {}
+        self.failures = {}
+
+    def send(self, key, data):
+        with self.lock:
+            self.attempts[data] = self.attempts.get(data, 0) + 1
+            return self.attempts[data] > self.failures.get(data, 0)
+
+    def test_delivers_all(self):
+        pool = DeliveryPool('Test', self.send, workers=3)
+        for i in range(20):
+            pool.submit('endpoint', i)
+
+        self.assertTrue(pool.wait(5))
+        self.assertEqual(self.attempts, {i: 1 for i in range(20)})
+
+    def test_retries_with_backoff(self):
+        self.failures = {'flaky': 2, 'broken': 100}
+        pool = DeliveryPool('Test', self.send, workers=2, max_attempts=3, backoff=0.01)
+        pool.submit('endpoint', 'flaky')
+        pool.submit('endpoint', 'broken')
+        pool.submit('endpoint', 'fine')
+
+        self.assertTrue(pool.wait(5))
+        self.assertEqual(self.attempts, {'flaky': 3, 'broken': 3, 'fine': 1})
+
+    def test_rate_limited_is_not_an_attempt(self):
+        calls = []
+
+        def send(key, data):
+            calls.append(data)
+            if len(calls) <= 3:
+                raise RateLimited(0.01)
+            return True
+
+        pool = DeliveryPool('Test', send, workers=1, max_attempts=1)
+        pool.submit('endpoint', 'data')
+
+        self.assertTrue(pool.wait(5))
+        self.assertEqual(calls, ['data'] * 4)
+
+    def test_coalesce(self):
+        sent = []
+
+        def send(key, data):
+            sent.append(data)
+            return True
+
+        def coalesce(datas):
+            return sum(datas[:3], []), min(len(datas), 3)
+
+        pool = DeliveryPool('Test', send, workers=1, coalesce=coalesce)
+        with pool.condition:
+            # hold the workers back until everything is queued
+            for i in range(7):
+                pool.submit('endpoint', [i])
+
+        self.assertTrue(pool.wait(5))
+        self.assertEqual(sorted(sum(sent, [])), range(7))
+        self.assertTrue(len(sent) < 7)
+        self.assertEqual(pool.pending(), 0)
+
+    def test_coalesce_by_key(self):
+        sent = []
+
+        def send(key, data):
+            sent.append((key, data))
+            return True
+
+        def coalesce(datas):
+            return sum(datas, []), len(datas)
+
+        pool = DeliveryPool('Test', send, workers=1, coalesce=coalesce)
+        with pool.condition:
+            for i in range(6):
+                pool.submit('endpoint%d' % (i % 2), [i])
+
+        self.assertTrue(pool.wait(5))
+        merged = {}
+        for key, data in sent:
+            merged.setdefault(key, []).extend(data)
+        self.assertEqual(merged, {'endpoint0': [0, 2, 4], 'endpoint1': [1, 3, 5]})
+        self.assertEqual(pool.scheduled_by_key, {})
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_unknown_limit(self):
+        bucket = TokenBucket()
+        self.assertEqual(bucket.reserve(now=0), 0)
+
+    def test_learned_limit(self):
+        bucket = TokenBucket()
+        bucket.update(limit=5, remaining=2, reset_after=2, now=100)
+
+        self.assertEqual(bucket.reserve(now=100), 0)
+        self.assertEqual(bucket.reserve(now=100.5), 0)
+        self.assertEqual(bucket.reserve(now=101), 1)
+
+        # the window has been reset
+        self.assertEqual(bucket.reserve(now=102), 0)
+        self.assertEqual(bucket.remaining, 4)
+
+    def test_window_rolls_over(self):
+        bucket = TokenBucket()
+        bucket.update(limit=2, remaining=0, reset_after=2, now=100)
+
+        # the next window starts at 102 and ends at 104, without any new headers
+        self.assertEqual(bucket.reserve(now=102), 0)
+        self.assertEqual(bucket.reserve(now=102.5), 0)
+        self.assertEqual(bucket.reserve(now=103), 1)
+        self.assertEqual(bucket.reserve(now=104), 0)
+
+    def test_block(self):
+        bucket = TokenBucket()
+        bucket.block(3, now=10)
+
+        self.assertEqual(bucket.reserve(now=11), 2)
+        self.assertEqual(bucket.reserve(now=13), 0)
+
+
+class TestDiscordRetryAfter(unittest.TestCase):
+    def test_headers(self):
+        url = 'https://discordapp.com/api/webhooks/1/token'
+        self.assertEqual(Discord.get_retry_after(FakeResponse(url, {'Retry-After': '2'}, {'retry_after': 2000})), 2.0)
+        self.assertEqual(Discord.get_retry_after(FakeResponse(url, {'X-RateLimit-Reset-After': '1.5'})), 1.5)
+
+    def test_body(self):
+        # milliseconds before api version 8, which is what unversioned webhook urls use
+        response = FakeResponse('https://discordapp.com/api/webhooks/1/token', body={'retry_after': 1500})
+        self.assertEqual(Discord.get_retry_after(response), 1.5)
+        response = FakeResponse('https://discord.com/api/v6/webhooks/1/token', body={'retry_after': 1500})
+        self.assertEqual(Discord.get_retry_after(response), 1.5)
+
+        response = FakeResponse('https://discord.com/api/v10/webhooks/1/token', body={'retry_after': 1.5})
+        self.assertEqual(Discord.get_retry_after(response), 1.5)
+        response = FakeResponse('https://discord.com/api/v10/webhooks/1/token', body={'retry_after': 2})
+        self.assertEqual(Discord.get_retry_after(response), 2.0)
+
+    def test_no_body(self):
+        self.assertEqual(Discord.get_retry_after(FakeResponse('https://discord.com/api/webhooks/1/token')), 1.0)
+
+
+class TestDiscordCoalesce(unittest.TestCase):
+    def test_embed_limit(self):
+        payloads = [{'content': u'title %d' % i, 'embeds': [{'title': i}]} for i in range(12)]
+        data, merged = Discord.coalesce(payloads)
+
+        self.assertEqual(merged, 10)
+        self.assertEqual(len(data['embeds']), 10)
+        self.assertEqual(data['content'], u'\n'.join(u'title %d' % i for i in range(10)))
+
+    def test_content_limit(self):
+        payloads = [{'content': u'x' * 1500, 'embeds': []}, {'content': u'y' * 1500, 'embeds': []}]
+
+        self.assertEqual(Discord.coalesce(payloads), (payloads[0], 1))
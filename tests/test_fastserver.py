@@ -0,0 +1,142 @@
+from fastserver import FastReceiver, LatencyRecorder
+from gevent import socket
+import json
+import Queue
+import unittest
+
+
+class RecordingReceiver:
+    def __init__(self):
+        self.bodies = Queue.Queue()
+        self.report = None
+
+    def profile_report(self):
+        return self.report
+
+    def process(self, body):
+        self.bodies.put(json.loads(body))
+
+
+def request(method, path, body='', headers=''):
+    return '%s %s HTTP/1.1\r\nHost: localhost\r\n%sContent-Length: %d\r\n\r\n%s' % (method, path, headers, len(body), body)
+
+
+class TestFastReceiver(unittest.TestCase):
+    def setUp(self):
+        self.receiver = RecordingReceiver()
+        self.server = FastReceiver(self.receiver, '127.0.0.1', 0)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.server.stop()
+
+    def connect(self):
+        return socket.create_connection(('127.0.0.1', self.server.server.server_port))
+
+    @staticmethod
+    def read_responses(connection, count):
+        data = ''
+        # responses to POST requests have no body
+        while data.count('HTTP/1.1 ') < count or not data.endswith('\r\n\r\n'):
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def test_pipelining(self):
+        connection = self.connect()
+        connection.sendall(''.join(request('POST', '/', json.dumps({'frame': i})) for i in range(5)))
+
+        responses = self.read_responses(connection, 5)
+        self.assertEqual(responses.count('HTTP/1.1 200 OK'), 5)
+        self.assertEqual([self.receiver.bodies.get(timeout=5) for _ in range(5)], [{'frame': i} for i in range(5)])
+
+        # the connection is still open
+        connection.sendall(request('POST', '/', '[]', 'Connection: close\r\n'))
+        self.assertTrue(self.read_responses(connection, 1).startswith('HTTP/1.1 200 OK'))
+        self.assertEqual(connection.recv(1), '')
+        connection.close()
+
+    def test_large_body(self):
+        frames = [{'frame': i, 'padding': 'x' * 1000} for i in range(500)]
+        connection = self.connect()
+        connection.sendall(request('POST', '/', json.dumps(frames), 'Connection: close\r\n'))
+
+        self.assertTrue(self.read_responses(connection, 1).startswith('HTTP/1.1 200 OK'))
+        self.assertEqual(self.receiver.bodies.get(timeout=5), frames)
+        connection.close()
+
+    def test_body_too_large(self):
+        self.server.max_body_size = 10
+        connection = self.connect()
+        connection.sendall(request('POST', '/', json.dumps({'frame': 'too large'})))
+
+        self.assertTrue(self.read_responses(connection, 1).startswith('HTTP/1.1 413 Payload Too Large'))
+        self.assertEqual(connection.recv(1), '')
+        self.assertTrue(self.receiver.bodies.empty())
+        connection.close()
+
+    def test_queue_full(self):
+        # without the parse thread, nothing takes the queued body
+        server = FastReceiver(self.receiver, '127.0.0.1', 0, queue_size=1)
+        server.server.start()
+        try:
+            connection = socket.create_connection(('127.0.0.1', server.server.server_port))
+            connection.sendall(request('POST', '/', '{}') + request('POST', '/', '{}'))
+
+            responses = self.read_responses(connection, 2)
+            self.assertTrue(responses.startswith('HTTP/1.1 200 OK'))
+            self.assertEqual(responses.count('HTTP/1.1 503 Service Unavailable'), 1)
+            self.assertEqual(server.bodies.qsize(), 1)
+            connection.close()
+        finally:
+            server.server.stop()
+
+    def get(self, path, connection=None):
+        # returns the status line and the body
+        connection = connection or self.connect()
+        connection.sendall(request('GET', path, headers='Connection: close\r\n'))
+        response = ''
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+        connection.close()
+
+        head, body = response.split('\r\n\r\n', 1)
+        return head.split('\r\n', 1)[0], body
+
+    def test_stats(self):
+        connection = self.connect()
+        connection.sendall(request('POST', '/', '{}'))
+        self.read_responses(connection, 1)
+
+        status, body = self.get('/stats', connection)
+        stats = json.loads(body)
+        self.assertEqual(stats['requests'], 1)
+        self.assertTrue(stats['p99_ms'] >= 0)
+
+    def test_metrics(self):
+        status, body = self.get('/metrics')
+        self.assertEqual(status, 'HTTP/1.1 200 OK')
+        self.assertEqual(sorted(json.loads(body)), ['counters', 'stages', 'stats'])
+
+    def test_profile(self):
+        status, body = self.get('/profile')
+        self.assertEqual(status, 'HTTP/1.1 404 Not Found')
+
+        self.receiver.report = 'kind include rule'
+        status, body = self.get('/profile')
+        self.assertEqual(status, 'HTTP/1.1 200 OK')
+        self.assertEqual(body, 'kind include rule\n')
+
+
+class TestLatencyRecorder(unittest.TestCase):
+    def test_percentiles(self):
+        recorder = LatencyRecorder()
+        for i in range(1, 101):
+            recorder.add(i / 1000.0)
+
+        self.assertEqual(recorder.percentiles(), {'requests': 100, 'p50_ms': 51.0, 'p90_ms': 91.0, 'p99_ms': 100.0})
@@ -0,0 +1,70 @@
+from notifier import geofence, utils
+from notifier.geofence import GeofenceIndex, PreparedPolygon, make_polygon
+import random
+import unittest
+
+
+class TestGeofence(unittest.TestCase):
+    def test_matches_ray_casting(self):
+        rng = random.Random(42)
+        for vertices in (4, 17, 300, 2000):
+            polygon = make_polygon(rng, vertices, 47.6, -122.3, 0.1)
+            prepared = PreparedPolygon('test', polygon)
+
+            for _ in range(2000):
+                x = rng.uniform(47.45, 47.75)
+                y = rng.uniform(-122.45, -122.15)
+                self.assertEqual(prepared.contains(x, y), utils.is_inside_polygon(polygon, x, y))
+
+    def test_vertices_and_axis_aligned_edges(self):
+        polygon = [(0.0, 0.0), (0.0, 4.0), (4.0, 4.0), (4.0, 2.0), (2.0, 2.0), (2.0, 0.0)]
+        prepared = PreparedPolygon('test', polygon)
+
+        points = [(x / 2.0, y / 2.0) for x in range(-1, 10) for y in range(-1, 10)]
+        for x, y in points + polygon:
+            self.assertEqual(prepared.contains(x, y), utils.is_inside_polygon(polygon, x, y), (x, y))
+
+    def test_geofences_at(self):
+        index = GeofenceIndex({
+            'big': {'polygon': [(0.0, 0.0), (0.0, 10.0), (10.0, 10.0), (10.0, 0.0)]},
+            'small': {'polygon': [(1.0, 1.0), (1.0, 2.0), (2.0, 2.0), (2.0, 1.0)]},
+            'far': {'polygon': [(50.0, 50.0), (50.0, 51.0), (51.0, 51.0), (51.0, 50.0)]},
+            'empty': {'polygon': []}
+        })
+
+        self.assertEqual(index.geofences_at(1.5, 1.5), frozenset(['big', 'small']))
+        self.assertEqual(index.geofences_at(5, 5), frozenset(['big']))
+        self.assertEqual(index.geofences_at(50.5, 50.5), frozenset(['far']))
+        self.assertEqual(index.geofences_at(-5, -5), frozenset())
+        self.assertTrue(index.contains('small', 1.5, 1.5))
+        self.assertFalse(index.contains('empty', 1.5, 1.5))
+
+    def check_geofences_at_many(self):
+        rng = random.Random(7)
+        geofences = {}
+        for i in range(5):
+            polygon = make_polygon(rng, 50 * (i + 1), rng.uniform(0, 1), rng.uniform(0, 1), 0.4)
+            geofences['fence%d' % i] = {'polygon': polygon}
+        index = GeofenceIndex(geofences)
+
+        points = [(rng.uniform(-0.5, 1.5), rng.uniform(-0.5, 1.5)) for _ in range(500)] + [(None, None)]
+        result = index.geofences_at_many(points)
+
+        self.assertEqual(sorted(result), sorted(points))
+        for x, y in points:
+            expected = frozenset(name for name in geofences
+                                 if x is not None and utils.is_inside_polygon(geofences[name]['polygon'], x, y))
+            self.assertEqual(result[(x, y)], expected)
+            self.assertEqual(result[(x, y)], index.geofences_at(x, y))
+
+    @unittest.skipIf(geofence.numpy is None, 'NumPy is not installed')
+    def test_geofences_at_many_numpy(self):
+        self.check_geofences_at_many()
+
+    def test_geofences_at_many_without_numpy(self):
+        numpy = geofence.numpy
+        geofence.numpy = None
+        try:
+            self.check_geofences_at_many()
+        finally:
+            geofence.numpy = numpy
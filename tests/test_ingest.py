@@ -0,0 +1,127 @@
+from notifier.ingest import ExpiryFilter, IngestQueue, QueueFull, iter_frames
+from StringIO import StringIO
+import json
+import Queue
+import time
+import unittest
+
+
+def pokemon(i, disappear_time=None):
+    if disappear_time is None:
+        disappear_time = time.time() + 600
+    return {'type': 'pokemon', 'message': {'encounter_id': i, 'disappear_time': disappear_time}}
+
+
+def raid(i):
+    return {'type': 'raid', 'message': {'gym_id': i, 'end': time.time() + 600}}
+
+
+def drain(queue):
+    frames = []
+    while True:
+        try:
+            frames.append(queue.get_nowait())
+        except Queue.Empty:
+            return frames
+
+
+class TestIngestQueue(unittest.TestCase):
+    def test_unbounded(self):
+        queue = IngestQueue(0)
+        for i in range(100):
+            queue.put(pokemon(i))
+
+        self.assertEqual(len(drain(queue)), 100)
+        self.assertRaises(Queue.Empty, queue.get, timeout=0.01)
+
+    def test_drop_oldest(self):
+        queue = IngestQueue(3, 'drop_oldest')
+        for i in range(5):
+            queue.put(pokemon(i))
+
+        self.assertEqual([f['message']['encounter_id'] for f in drain(queue)], [2, 3, 4])
+        self.assertEqual(queue.stats()['oldest'], 2)
+
+    def test_drop_expired(self):
+        queue = IngestQueue(3, 'drop_expired')
+        queue.put(pokemon(0))
+        queue.put(pokemon(1, time.time() - 10))
+        queue.put(pokemon(2, time.time() - 10))
+        queue.put(pokemon(3))
+        queue.put(pokemon(4))
+
+        self.assertEqual([f['message']['encounter_id'] for f in drain(queue)], [0, 3, 4])
+        self.assertEqual(queue.stats()['expired'], 2)
+        self.assertEqual(queue.stats()['oldest'], 0)
+
+    def test_drop_expired_sweeps_once_per_interval(self):
+        queue = IngestQueue(2, 'drop_expired', sweep_interval=60)
+        queue.put(pokemon(0, time.time() - 10))
+        queue.put(pokemon(1))
+        queue.put(pokemon(2))
+        queue.put(pokemon(3, time.time() - 10))
+        queue.put(pokemon(4))
+
+        # until the next sweep the oldest frames are dropped, so the expired frame 3 is still queued
+        self.assertEqual([f['message']['encounter_id'] for f in drain(queue)], [3, 4])
+        self.assertEqual(queue.stats()['expired'], 1)
+        self.assertEqual(queue.stats()['oldest'], 2)
+
+    def test_prioritise_raids(self):
+        queue = IngestQueue(3, 'prioritise_raids')
+        queue.put(raid(0))
+        queue.put(pokemon(1))
+        queue.put(raid(2))
+        queue.put(raid(3))
+        queue.put(pokemon(4))
+
+        self.assertEqual([f['type'] for f in drain(queue)], ['raid', 'raid', 'raid'])
+        self.assertEqual(queue.stats()['pokemon'], 1)
+        self.assertEqual(queue.stats()['incoming'], 1)
+
+    def test_reject(self):
+        queue = IngestQueue(2, 'reject')
+        queue.put(pokemon(0))
+        queue.put(pokemon(1))
+
+        self.assertRaises(QueueFull, queue.put, pokemon(2))
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.stats()['rejected'], 1)
+
+
+class TestExpiryFilter(unittest.TestCase):
+    def test_min_time_left(self):
+        expiry_filter = ExpiryFilter(min_pokemon_time_left=60, min_raid_time_left=300)
+        now = 1000
+
+        self.assertTrue(expiry_filter.accept(pokemon(0, now + 60), now))
+        self.assertFalse(expiry_filter.accept(pokemon(1, now + 59), now))
+        self.assertFalse(expiry_filter.accept(pokemon(2, now - 10), now))
+
+        self.assertTrue(expiry_filter.accept({'type': 'raid', 'message': {'end': now + 300}}, now))
+        self.assertFalse(expiry_filter.accept({'type': 'raid', 'message': {'end': now + 120}}, now))
+        self.assertTrue(expiry_filter.accept({'type': 'gym_details', 'message': {'id': 'gym'}}, now))
+
+        self.assertEqual(expiry_filter.stats(), {'pokemon': 2, 'raid': 1})
+
+
+class TestIterFrames(unittest.TestCase):
+    def test_array(self):
+        frames = [pokemon(i) for i in range(50)] + [raid(i) for i in range(50)]
+        body = json.dumps(frames, indent=2)
+
+        for chunk_size in (1, 7, 4096):
+            self.assertEqual(list(iter_frames(StringIO(body), chunk_size=chunk_size)), frames)
+
+    def test_single_frame(self):
+        self.assertEqual(list(iter_frames(StringIO(' {"type": "raid"} '), chunk_size=3)), [{'type': 'raid'}])
+        self.assertEqual(list(iter_frames(StringIO(''))), [])
+
+    def test_length(self):
+        body = '[{"a": 1}, {"b": 2.5}]'
+        self.assertEqual(list(iter_frames(StringIO(body + 'trailing'), len(body), 4)), [{'a': 1}, {'b': 2.5}])
+
+    def test_frames_before_error(self):
+        frames = iter_frames(StringIO('[{"a": 1}, {"b": '), chunk_size=4)
+        self.assertEqual(next(frames), {'a': 1})
+        self.assertRaises(ValueError, next, frames)
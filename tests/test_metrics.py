@@ -0,0 +1,116 @@
+from notifier import NotificationHandler
+from notifier.cluster import ShardedNotifierManager
+from notifier.ingest import QueueFull
+from notifier.manager import NotifierManager
+from notifier.metrics import Histogram, Metrics, metrics
+import json
+import time
+import unittest
+
+
+class NullHandler(NotificationHandler):
+    def notify_pokemon(self, endpoint, pokemon):
+        pass
+
+
+class TestMetrics(unittest.TestCase):
+    @staticmethod
+    def _make_config():
+        return {
+            "config": {"metrics": True},
+            "includes": {"all": {"pokemons": [{"min_id": 0, "max_id": 999}]}},
+            "notification_settings": {"Default": {"includes": ["all"]}}
+        }
+
+    @staticmethod
+    def _get_frame(disappear_time):
+        with open('tests/data/webhooks/pokemon-without-encounter.json') as f:
+            frame = json.load(f)
+        frame['message']['disappear_time'] = disappear_time
+        return frame
+
+    def tearDown(self):
+        metrics.enabled = False
+        metrics.reset()
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for i in range(100):
+            histogram.observe(0.001 if i < 90 else 0.5)
+
+        self.assertTrue(0.001 <= histogram.percentile(50) < 0.002)
+        self.assertTrue(0.5 <= histogram.percentile(99) < 1)
+        self.assertEqual(histogram.summary()['count'], 100)
+        self.assertEqual(histogram.summary()['max_ms'], 500.0)
+
+    def test_disabled(self):
+        disabled = Metrics()
+        disabled.count('frames', 'pokemon')
+        disabled.observe('match', 'pokemon', 0.1)
+        self.assertEqual(disabled.snapshot(), {'counters': {}, 'stages': {}, 'stats': {}})
+
+    def test_providers(self):
+        registry = Metrics()
+        registry.register('store', lambda: {'size': 1})
+        registry.register('store', lambda: {'size': 2})
+        self.assertEqual(registry.snapshot()['stats'], {'store': {'size': 2}})
+
+    def test_pipeline_stages(self):
+        manager = NotifierManager(self._make_config())
+        manager.notifier.set_notification_handler('simple', NullHandler())
+
+        manager.enqueue(self._get_frame(time.time() + 600))
+        manager.process([manager.queue.get_nowait()])
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'frames.pokemon': 1, 'matched.pokemon': 1})
+        for stage in ('ingest.pokemon', 'queue_wait.pokemon', 'match.pokemon', 'enrich.pokemon', 'deliver.simple'):
+            self.assertEqual(snapshot['stages'][stage]['count'], 1, stage)
+
+    def test_dedup_stats(self):
+        manager = NotifierManager(self._make_config())
+        manager.notifier.set_notification_handler('simple', NullHandler())
+        manager.process([self._get_frame(time.time() + 600)])
+
+        pokemons = metrics.snapshot()['stats']['dedup']['pokemons']
+        self.assertEqual(pokemons['size'], 1)
+        self.assertEqual(pokemons['bytes'], manager.handler.processed_pokemons.memory_usage())
+
+    def test_cp_table_stats(self):
+        config = self._make_config()
+        config['config']['cp_table'] = 'lazy'
+        manager = NotifierManager(config)
+        self.assertEqual(metrics.snapshot()['stats']['cp_table'], {'cp_tables': 0, 'hp_tables': 0, 'bytes': 0})
+
+        manager.handler.get_cp(149, 30.0, 15, 14, 13)
+        self.assertEqual(metrics.snapshot()['stats']['cp_table']['cp_tables'], 1)
+
+    def test_expired_frames(self):
+        manager = NotifierManager(self._make_config())
+        manager.enqueue(self._get_frame(time.time() - 10))
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'expired.pokemon': 1})
+        self.assertEqual(snapshot['stages']['ingest.pokemon']['count'], 1)
+
+    def test_rejected_frames(self):
+        config = self._make_config()
+        config['config'].update({'queue_size': 1, 'queue_policy': 'reject'})
+        manager = NotifierManager(config)
+        manager.enqueue(self._get_frame(time.time() + 600))
+        self.assertRaises(QueueFull, manager.enqueue, self._get_frame(time.time() + 600))
+        manager.enqueue(self._get_frame(time.time() - 10))
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'frames.pokemon': 1, 'rejected.pokemon': 1, 'expired.pokemon': 1})
+        self.assertEqual(snapshot['stats']['ingest']['queue']['rejected'], 1)
+        self.assertEqual(snapshot['stats']['ingest']['expired'], {'pokemon': 1, 'raid': 0})
+
+    def test_sharded_ingest(self):
+        manager = ShardedNotifierManager(self._make_config(), 2)
+        manager.enqueue(self._get_frame(time.time() + 600))
+        manager.enqueue(self._get_frame(time.time() - 10))
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'frames.pokemon': 1, 'expired.pokemon': 1})
+        self.assertEqual(snapshot['stages']['ingest.pokemon']['count'], 2)
@@ -1,6 +1,11 @@
 from notifier import Notifier, NotificationHandler
 from notifier.manager import NotifierManager
+from notifier.metrics import metrics
+from notifier.reload import restart_settings
 import json
+import os
+import shutil
+import tempfile
 import unittest
 
 
@@ -216,6 +221,203 @@ class TestNotifier(unittest.TestCase):
 
         self.assertTrue(self.notificationhandler.notify_raid_called)
 
+    def test_batch_geofence(self):
+        self.setup_geofence()
+
+        inside = self._get_data("pokemon-without-encounter")
+        inside['message']['latitude'], inside['message']['longitude'] = get_geofence_coords(True)
+        outside = self._get_data("pokemon-without-encounter")
+        outside['message']['encounter_id'] = 'outside'
+        outside['message']['latitude'], outside['message']['longitude'] = get_geofence_coords(False)
+
+        notified = []
+
+        def test_geofence(endpoint, pokemon):
+            notified.append((pokemon['lat'], pokemon['lon']))
+
+        self.notificationhandler.on_pokemon = test_geofence
+        self.notifiermanager.process([inside, outside])
+
+        self.assertEqual(notified, [get_geofence_coords(True)])
+
+    def test_geofence_miss_keeps_batch(self):
+        self.setup_geofence()
+
+        inside = self._get_data("pokemon-without-encounter")
+        inside['message']['latitude'], inside['message']['longitude'] = get_geofence_coords(True)
+        self.notifierhandler.prime_geofences([inside])
+
+        outside = get_geofence_coords(False)
+        self.assertFalse(self.notifierhandler.is_inside_geofence('Someplace', outside[0], outside[1]))
+        self.assertEqual(sorted(self.notifierhandler.geofence_sets), sorted([get_geofence_coords(True), outside]))
+
+    def test_batch_without_geofence_rules(self):
+        config = self._make_config({'min_id': 1})
+        config['config']['geofence_file'] = "tests/data/geofence/geofences.txt"
+        self.notifiermanager = NotifierManager(config)
+        self.assertFalse(self.notifiermanager.config.uses_geofences)
+
+        inside = self._get_data("pokemon-without-encounter")
+        inside['message']['latitude'], inside['message']['longitude'] = get_geofence_coords(True)
+        self.notifiermanager.handler.prime_geofences([inside])
+        self.assertEqual(self.notifiermanager.handler.geofence_sets, {})
+
+    def test_local_sublocality(self):
+        config = self._make_config({"min_id": 0, "max_id": 999})
+        config['config']['sublocality_file'] = "tests/data/geofence/geofences.txt"
+        self.notifiermanager = NotifierManager(config)
+        self.notifier = self.notifiermanager.notifier
+
+        self.assertEqual(self.notifier.get_sublocality(*get_geofence_coords(True)), 'Someplace')
+        self.assertIsNone(self.notifier.get_sublocality(*get_geofence_coords(False)))
+
+        notificationhandler = TestNotificationHandler()
+        self.notifier.set_notification_handler("simple", notificationhandler)
+
+        message = self._get_data("pokemon-without-encounter")['message']
+        message['latitude'], message['longitude'] = get_geofence_coords(True)
+
+        def test(endpoint, pokemon):
+            self.assertEqual(pokemon['sublocality'], 'Someplace')
+
+        notificationhandler.on_pokemon = test
+        self.notifiermanager.handler.handle_pokemon(message)
+
+        self.assertTrue(notificationhandler.notify_pokemon_called)
+
+    def test_sublocality_cache_saved_on_stop(self):
+        cache_dir = tempfile.mkdtemp()
+        cache_file = os.path.join(cache_dir, 'sublocalities.json')
+        try:
+            config = self._make_config({"min_id": 0, "max_id": 999})
+            config['config'] = {'fetch_sublocality': True, 'google_key': 'key', 'sublocality_cache_file': cache_file}
+            self.notifiermanager = NotifierManager(config)
+            self.notifiermanager.notifier.sublocality_cache.lookup = lambda lat, lon: 'Downtown'
+            self.assertEqual(self.notifiermanager.notifier.get_sublocality(47.6, -122.3), 'Downtown')
+            self.assertFalse(os.path.exists(cache_file))
+
+            self.notifiermanager.stop()
+            with open(cache_file) as f:
+                self.assertEqual(json.load(f), [['47.600,-122.300', 'Downtown']])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_render_once_per_handler_type(self):
+        config = self._make_config({"min_id": 0, "max_id": 999})
+        config['endpoints'] = {'first': {'type': 'simple'}, 'second': {'type': 'simple'}}
+        config['notification_settings']['Default']['endpoints'] = ['first']
+        config['notification_settings']['Other'] = {'includes': ['default_pokemon'], 'endpoints': ['second']}
+        self.notifiermanager = NotifierManager(config)
+
+        notificationhandler = RenderCountingHandler()
+        self.notifiermanager.notifier.set_notification_handler("simple", notificationhandler)
+        self.notifiermanager.handler.handle_pokemon(self._get_data("pokemon-without-encounter")['message'])
+
+        self.assertEqual(notificationhandler.rendered, 1)
+        self.assertEqual(notificationhandler.delivered, [{'type': 'simple'}, {'type': 'simple'}])
+
+    def test_overlapping_settings(self):
+        config = self._make_config({"min_id": 0, "max_id": 999})
+        config['endpoints'] = {'shared': {'type': 'simple'}}
+        config['includes']['everything'] = {'pokemons': [{"min_id": 0, "max_id": 999}]}
+        config['notification_settings']['Default']['endpoints'] = ['shared']
+        config['notification_settings']['Other'] = {'includes': ['everything'], 'endpoints': ['shared']}
+        self.notifiermanager = NotifierManager(config)
+        self.assertEqual(self.notifiermanager.config.pokemon_includes_to_endpoints,
+                         {'default_pokemon': ['shared'], 'everything': ['shared']})
+
+        notificationhandler = RenderCountingHandler()
+        self.notifiermanager.notifier.set_notification_handler("simple", notificationhandler)
+        self.notifiermanager.handler.handle_pokemon(self._get_data("pokemon-without-encounter")['message'])
+
+        self.assertEqual(notificationhandler.delivered, [{'type': 'simple'}])
+
+    def test_dispatch_validation(self):
+        config = self._make_config({"min_id": 0, "max_id": 999})
+        config['notification_settings']['Default']['endpoints'] = ['missing']
+        self.assertRaises(RuntimeError, NotifierManager, config)
+
+        config = self._make_config({"min_id": 0, "max_id": 999})
+        config['endpoints'] = {'carrier_pigeon': {'type': 'pigeon'}}
+        config['notification_settings']['Default']['endpoints'] = ['carrier_pigeon']
+        self.assertRaises(RuntimeError, NotifierManager, config)
+
+    def test_dispatch_tables(self):
+        dispatch = self.config.pokemon_dispatch['default_pokemon']
+        self.assertEqual(dispatch, ((self.notificationhandler, 'simple', {}),))
+
+    def test_reload(self):
+        notificationhandler = RenderCountingHandler()
+        self.notifier.set_notification_handler("simple", notificationhandler)
+        message = self._get_data("pokemon-without-encounter")['message']
+        self.notifierhandler.handle_pokemon(message)
+
+        config = self._make_config({"min_id": 0, "max_id": 999})
+        config['notification_settings']['Other'] = {'includes': ['default_pokemon']}
+        self.notifiermanager.reloader.config_file = config
+        self.assertTrue(self.notifiermanager.reloader.reload())
+        self.notifiermanager.apply_pending_config()
+
+        reloaded = self.notifiermanager.config
+        self.assertIsNot(reloaded, self.config)
+        self.assertIs(self.notifierhandler.config, reloaded)
+        self.assertIs(self.notifier.config, reloaded)
+        self.assertIs(reloaded.notification_handlers['simple'], notificationhandler)
+
+        # already notified before the reload
+        self.notifierhandler.handle_pokemon(message)
+        self.assertEqual(notificationhandler.rendered, 1)
+
+        message = dict(message, encounter_id='another encounter')
+        self.notifierhandler.handle_pokemon(message)
+        self.assertEqual(notificationhandler.rendered, 2)
+
+    def test_reload_settings(self):
+        config = self._make_config({"min_id": 0, "max_id": 999})
+        config['config'] = {'dedup_capacity': 10, 'metrics': True}
+        self.notifiermanager.reloader.config_file = config
+        self.assertTrue(self.notifiermanager.reloader.reload())
+
+        reloaded = self.notifiermanager.pending_config[0]
+        self.assertEqual(restart_settings(self.config, reloaded), ['dedup_capacity'])
+
+        try:
+            self.notifiermanager.apply_pending_config()
+            self.assertTrue(metrics.enabled)
+
+            # metrics can be switched off again
+            self.notifiermanager.apply_config(self.config)
+            self.assertFalse(metrics.enabled)
+        finally:
+            metrics.enabled = False
+
+    def test_failed_reload(self):
+        self.notifiermanager.reloader.config_file = {'config': {}}
+        self.assertFalse(self.notifiermanager.reloader.reload())
+        self.notifiermanager.apply_pending_config()
+        self.assertIs(self.notifiermanager.config, self.config)
+
+    def test_reload_on_file_change(self):
+        fd, config_file = tempfile.mkstemp(suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._make_config(), f)
+            self.notifiermanager = NotifierManager(config_file, watch=False)
+            reloader = self.notifiermanager.reloader
+            self.assertFalse(reloader.changed())
+
+            mtime = os.path.getmtime(config_file)
+            os.utime(config_file, (mtime + 10, mtime + 10))
+            self.assertTrue(reloader.changed())
+            self.assertFalse(reloader.changed())
+        finally:
+            os.remove(config_file)
+
+    def test_unsupported_frames_dropped(self):
+        self.notifiermanager.enqueue({'type': 'reload'})
+        self.assertEqual(len(self.notifiermanager.queue), 0)
+        self.assertFalse(self.notifiermanager.reloader.requested.is_set())
+
     def test_raid_outside_geofence(self):
         self.setup_geofence()
 
@@ -226,6 +428,20 @@ class TestNotifier(unittest.TestCase):
         self.assertFalse(self.notificationhandler.notify_raid_called)
 
 
+class RenderCountingHandler(NotificationHandler):
+    def __init__(self):
+        super(RenderCountingHandler, self).__init__()
+        self.rendered = 0
+        self.delivered = []
+
+    def render(self, kind, data):
+        self.rendered += 1
+        return {'content': data['name']}
+
+    def deliver(self, endpoint, kind, payload):
+        self.delivered.append(endpoint)
+
+
 def get_geofence_coords(inside):
     if inside:
         return 47.63527390649546, -122.376708984375
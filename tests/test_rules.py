@@ -0,0 +1,65 @@
+from notifier import NotificationHandler
+from notifier.manager import NotifierManager
+from notifier.rules import PokemonRuleIndex
+import json
+import unittest
+
+
+class TestRules(unittest.TestCase):
+    def test_species_buckets(self):
+        index = PokemonRuleIndex({
+            'named': [{'name': 'Bulbasaur', 'min_iv': 90}],
+            'range': [{'min_id': 10, 'max_id': 12}],
+            'everything': [{'min_iv': 100}]
+        })
+
+        self.assertEqual([r.include_ref for r in index.candidates(1)], ['named', 'everything'])
+        self.assertEqual([r.include_ref for r in index.candidates(11)], ['range', 'everything'])
+        self.assertEqual([r.include_ref for r in index.candidates(13)], ['everything'])
+
+    def test_name_outside_id_range(self):
+        index = PokemonRuleIndex({'named': [{'name': 'Bulbasaur', 'min_id': 2}]})
+
+        self.assertEqual(index.candidates(1), [])
+
+    def test_thresholds(self):
+        index = PokemonRuleIndex({'rule': [{'min_id': 1, 'max_id': 1, 'min_iv': 50, 'max_attack': 10}]})
+        rule = index.candidates(1)[0]
+
+        self.assertEqual(rule.keys, ['iv', 'attack'])
+        self.assertIsNone(rule.matches_thresholds({'name': 'Bulbasaur', 'iv': 60, 'attack': 5}))
+        self.assertEqual(rule.matches_thresholds({'name': 'Bulbasaur', 'iv': 40, 'attack': 5}), 'min_iv')
+        self.assertEqual(rule.matches_thresholds({'name': 'Bulbasaur', 'iv': 60, 'attack': 15}), 'max_attack')
+
+        # missing values never pass a minimum
+        self.assertEqual(rule.matches_thresholds({'name': 'Bulbasaur'}), 'min_iv')
+
+
+class NullHandler(NotificationHandler):
+    def notify_pokemon(self, endpoint, pokemon):
+        pass
+
+
+class TestRuleProfiler(unittest.TestCase):
+    def test_first_failing_predicates(self):
+        manager = NotifierManager({
+            "config": {"profile_rules": True},
+            "includes": {
+                "all": {"pokemons": [{"min_id": 0, "max_id": 999}]},
+                "picky": {"pokemons": [{"min_iv": 101},
+                                       {"min_id": 0, "max_id": 999, "moves": [{"move_1": "Nothing"}]}]}
+            },
+            "notification_settings": {"Default": {"includes": ["all", "picky"]}}
+        })
+        manager.notifier.set_notification_handler('simple', NullHandler())
+
+        with open('tests/data/webhooks/pokemon-without-encounter.json') as f:
+            message = json.load(f)['message']
+        manager.handler.handle_pokemon(message)
+
+        rows = {(row['include'], row['rule']): row for row in manager.handler.profiler.report()}
+        self.assertEqual(sorted(rows), [('all', 0), ('picky', 0), ('picky', 1)])
+        self.assertEqual(rows[('all', 0)]['matches'], 1)
+        self.assertEqual(rows[('picky', 0)]['failures'], [('min_iv', 1)])
+        self.assertEqual(rows[('picky', 1)]['failures'], [('moves', 1)])
+        self.assertTrue('picky' in manager.handler.profiler.format_report())
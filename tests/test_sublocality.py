@@ -0,0 +1,104 @@
+from notifier.sublocality import SublocalityCache
+from threading import Event, Thread
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestSublocality(unittest.TestCase):
+    def setUp(self):
+        self.lookups = []
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def lookup(self, lat, lon):
+        self.lookups.append((lat, lon))
+        return 'Area %d' % len(self.lookups)
+
+    def test_cells(self):
+        cache = SublocalityCache(self.lookup, precision=2)
+
+        self.assertEqual(cache.get(47.6011, -122.3011), 'Area 1')
+        self.assertEqual(cache.get(47.6049, -122.3049), 'Area 1')
+        self.assertEqual(cache.get(47.6151, -122.3011), 'Area 2')
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_lru_eviction(self):
+        cache = SublocalityCache(self.lookup, precision=0, max_size=2)
+        cache.get(1, 1)
+        cache.get(2, 2)
+        cache.get(1, 1)
+        cache.get(3, 3)
+
+        self.assertEqual(list(cache.cells), ['1,1', '3,3'])
+
+    def test_failures_are_not_cached(self):
+        def lookup(lat, lon):
+            self.lookups.append((lat, lon))
+            raise IOError('no network')
+
+        cache = SublocalityCache(lookup)
+
+        self.assertIsNone(cache.get(1, 1))
+        self.assertIsNone(cache.get(1, 1))
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_persistence(self):
+        cache_file = os.path.join(self.directory, 'sublocalities.json')
+        cache = SublocalityCache(self.lookup, cache_file=cache_file)
+        cache.get(1, 1)
+        cache.get(2, 2)
+        cache.save()
+
+        cache = SublocalityCache(self.lookup, cache_file=cache_file)
+        self.assertEqual(cache.get(2, 2), 'Area 2')
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_shared_cache_file(self):
+        cache_file = os.path.join(self.directory, 'sublocalities.json')
+        first = SublocalityCache(self.lookup, precision=0, max_size=3, cache_file=cache_file)
+        second = SublocalityCache(self.lookup, precision=0, max_size=3, cache_file=cache_file)
+        first.get(1, 1)
+        second.get(2, 2)
+        first.get(3, 3)
+        first.save()
+        second.save()
+
+        # both caches' cells are kept, and no temporary files are left behind
+        self.assertEqual(os.listdir(self.directory), ['sublocalities.json'])
+        cache = SublocalityCache(self.lookup, precision=0, max_size=3, cache_file=cache_file)
+        self.assertEqual(list(cache.cells), ['1,1', '3,3', '2,2'])
+
+        # the most recently saved cells are kept when they don't all fit
+        second.get(4, 4)
+        second.save()
+        cache = SublocalityCache(self.lookup, precision=0, max_size=3, cache_file=cache_file)
+        self.assertEqual(list(cache.cells), ['3,3', '2,2', '4,4'])
+
+    def test_in_flight_lookups(self):
+        started = Event()
+        release = Event()
+
+        def lookup(lat, lon):
+            self.lookups.append((lat, lon))
+            started.set()
+            release.wait(5)
+            return 'Slow'
+
+        cache = SublocalityCache(lookup)
+        results = []
+        first = Thread(target=lambda: results.append(cache.get(1, 1)))
+        first.start()
+        started.wait(5)
+
+        second = Thread(target=lambda: results.append(cache.get(1, 1)))
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(results, ['Slow', 'Slow'])
+        self.assertEqual(len(self.lookups), 1)
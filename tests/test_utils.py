@@ -1,4 +1,6 @@
 from notifier import utils
+from notifier import cptable
+from notifier.cptable import CpTable
 import unittest
 
 
@@ -52,4 +54,62 @@ class TestUtils(unittest.TestCase):
         outside = (47.59292021272622,-122.26753234863281)
 
         self.assertTrue(utils.point_in_poly(inside[0], inside[1], poly))
-        self.assertFalse(utils.point_in_poly(outside[0], outside[1], poly))
\ No newline at end of file
+        self.assertFalse(utils.point_in_poly(outside[0], outside[1], poly))
+
+
+class TestGameData(unittest.TestCase):
+    def setUp(self):
+        self.game_data = utils.get_game_data()
+
+    def test_shared_instance(self):
+        self.assertIs(self.game_data, utils.get_game_data())
+
+    def test_names(self):
+        self.assertEqual(self.game_data.pokemon_name(1), 'Bulbasaur')
+        self.assertEqual(self.game_data.pokemon_name('133'), 'Eevee')
+        self.assertEqual(self.game_data.pokemon_name(None), 'unknown')
+        self.assertEqual(self.game_data.pokemon_id('Eevee'), 133)
+        self.assertEqual(self.game_data.move_name(2), 'Quick Attack')
+        self.assertEqual(self.game_data.move_name(99999), 'unknown')
+
+    def test_cpm_for_level(self):
+        self.assertEqual(self.game_data.cpm_for_level(1), 0.09399)
+        self.assertEqual(self.game_data.cpm_for_level('5.5'), self.game_data.cpm_for_level(5.5))
+        self.assertIsNone(self.game_data.cpm_for_level(5.25))
+        self.assertIsNone(self.game_data.cpm_for_level(41))
+
+    def test_level_for_cpm(self):
+        self.assertEqual(self.game_data.level_for_cpm(0.5822789072990417), 19)
+        self.assertEqual(self.game_data.level_for_cpm(self.game_data.cpm_for_level(29.5)), 29.5)
+        self.assertEqual(self.game_data.level_for_cpm(self.game_data.cpm_for_level(40)), 40)
+        self.assertIsNone(self.game_data.level_for_cpm(0.5))
+        self.assertIsNone(self.game_data.level_for_cpm(0.01))
+        self.assertIsNone(self.game_data.level_for_cpm(1.5))
+
+
+class TestCpTable(unittest.TestCase):
+    def check_table(self, table):
+        for pokemon_id in (1, 143, 149):
+            for level in (1, 5.5, 20, 39):
+                for ivs in ((0, 0, 0), (15, 15, 15), (8, 10, 2), (15, 0, 7)):
+                    self.assertEqual(table.cp(pokemon_id, level, *ivs), utils.get_cp_for_level(pokemon_id, level, *ivs))
+                    self.assertEqual(table.hp(pokemon_id, level, ivs[2]),
+                                     utils.get_hp_for_level(pokemon_id, level, ivs[2]))
+
+    def test_python_table(self):
+        self.check_table(CpTable(utils.get_game_data(), use_numpy=False))
+
+    @unittest.skipIf(cptable.numpy is None, 'NumPy is not installed')
+    def test_numpy_table(self):
+        self.check_table(CpTable(utils.get_game_data(), use_numpy=True))
+
+    def test_memory_usage(self):
+        table = CpTable(utils.get_game_data(), use_numpy=False)
+        table.preload([1, 2], [20, '40'])
+
+        self.assertEqual(len(table.cp_tables), 4)
+        self.assertEqual(table.memory_usage(), 4 * 4096 * 2 + 4 * 16 * 2)
+
+        # lazily built tables are counted too
+        table.cp(3, 20, 0, 0, 0)
+        self.assertEqual(table.stats(), {'cp_tables': 5, 'hp_tables': 4, 'bytes': 5 * 4096 * 2 + 4 * 16 * 2})
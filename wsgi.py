@@ -1,5 +1,6 @@
 # For using a web server with the WSGI interface
 
+from notifier.ingest import QueueFull
 from server import Receiver
 
 receiver = Receiver("config/config.json")
@@ -10,10 +11,13 @@ def application(environ, start_response):
     except ValueError:
         request_body_size = 0
 
-    request_body = environ['wsgi.input'].read(request_body_size)
-    receiver.process(request_body)
+    try:
+        receiver.process_stream(environ['wsgi.input'], request_body_size)
+        status = '200 OK'
+    except QueueFull:
+        # tell the scanner to back off and send again later
+        status = '503 Service Unavailable'
 
-    status = '200 OK'
     response_headers = [('Content-type', 'text/plain')]
     start_response(status, response_headers)
     return ""